@@ -6,6 +6,17 @@ from . import gates
 from .gates import Gate2D, Gate1D, Gate2DFromHist2D, Gate1DFromHist1D
 from .run_handling import *
 from .scalers import Scalers
+from . import batch
+from .batch import run_batch
+from .cache import DetectorCache
+from .calibration import CalibrationTable
+from . import summary
+from .summary import RunSummary, summarize_run, select_runs, campaign_summary
+from . import timing
+from .timing import time_difference_hist, align_channels, coincidence_matrix
+from .strips import match_strips
+from . import online
+from .online import Online, FileFollower
 from .config import set_default_energy_col
 from .config import set_default_time_col
 import os
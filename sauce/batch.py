@@ -0,0 +1,243 @@
+"""
+Apply a single analysis to many run files using a pool of
+worker processes. Each finished run is written to disk as
+soon as it completes, so a campaign that is interrupted (or that
+has a few bad files) can be resumed without redoing the runs that
+already succeeded.
+
+The analysis is any picklable callable that takes a run filename
+and returns a dictionary of results. The results of all runs are
+merged key by key:
+
+- numpy arrays (e.g. Scalers.sum) are summed.
+- histograms returned by Detector.hist are summed bin by bin.
+- Detectors and polars DataFrames are concatenated.
+- anything else (livetimes, counts, ...) is kept as a per run list.
+"""
+
+import os
+import hashlib
+import multiprocessing
+import sys
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+import numpy as np
+import polars as pl
+from .detectors import Detector, detector_union
+from .summary import RunSummary, summarize_run
+
+Analysis = Union[Callable[[str], Dict[str, Any]], Sequence[Callable]]
+
+
+def _run_pipeline(analysis: Analysis, filename: str) -> Dict[str, Any]:
+    """Call the analysis on a filename. A sequence of callables
+    is treated as a pipeline where each step receives the output
+    of the previous one.
+    """
+    if callable(analysis):
+        return analysis(filename)
+    result: Any = filename
+    for step in analysis:
+        result = step(result)
+    return result
+
+
+def _partial_name(output_dir: str, filename: str) -> str:
+    # runs with the same name in different directories (or that only
+    # differ after a dot) must not share a partial result
+    digest = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+    return os.path.join(
+        output_dir, os.path.basename(filename) + "." + digest[:16] + ".pkl"
+    )
+
+
+def _worker_init(max_memory: Optional[int]):
+    """Set per worker limits before any analysis is run."""
+    if max_memory is not None:
+        try:
+            import resource
+
+            resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+        except (ImportError, ValueError, OSError):
+            print("Warning: unable to limit worker memory on this platform.")
+
+
+def _worker(
+    analysis: Analysis, filename: str, output_dir: Optional[str]
+) -> Dict[str, Any]:
+    result = _run_pipeline(analysis, filename)
+    if not isinstance(result, dict):
+        raise TypeError("Batch analysis must return a dictionary of results.")
+    if output_dir is not None:
+        # write to a temporary file first so a crash never leaves
+        # a half written result that looks finished
+        path = _partial_name(output_dir, filename)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(result, f)
+        os.replace(path + ".tmp", path)
+    return result
+
+
+def _is_hist(value: Any) -> bool:
+    return (
+        isinstance(value, tuple)
+        and len(value) == 2
+        and all(isinstance(v, np.ndarray) for v in value)
+    )
+
+
+def _merge_hists(hists: List[Any]) -> Any:
+    """Sum histograms produced by Detector.hist. With centers=True
+    these are (centers, counts), with centers=False (counts, edges).
+    """
+    a, b = hists[0]
+    bin_pos = 1 if len(b) == len(a) + 1 else 0
+    bins = hists[0][bin_pos]
+    for h in hists[1:]:
+        if not np.array_equal(h[bin_pos], bins):
+            raise ValueError("Cannot merge histograms with different bins.")
+    counts = np.sum([h[1 - bin_pos] for h in hists], axis=0)
+    return (bins, counts) if bin_pos == 0 else (counts, bins)
+
+
+def _merge_livetime(dets: List[Detector]) -> float:
+    """Livetime of the merged runs. Each livetime is kept / offered
+    hits, so the combined one is the ratio of the summed counts,
+    i.e. the hit weighted harmonic mean."""
+    kept = np.array([len(d) for d in dets], dtype=np.float64)
+    livetime = np.array([d.livetime for d in dets], dtype=np.float64)
+    counted = livetime > 0
+    kept, livetime = kept[counted], livetime[counted]
+    if kept.sum() == 0:
+        return float(np.mean([d.livetime for d in dets]))
+    return float(kept.sum() / (kept / livetime).sum())
+
+
+def merge_results(results: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge the per run dictionaries returned by a batch analysis.
+
+    :param results: list of result dictionaries, one per run
+    :returns: dictionary of merged results
+    """
+    merged: Dict[str, Any] = {}
+    keys: List[str] = []
+    for r in results:
+        keys += [k for k in r if k not in keys]
+    for key in keys:
+        values = [r[key] for r in results if key in r]
+        first = values[0]
+        if _is_hist(first):
+            merged[key] = _merge_hists(values)
+        elif isinstance(first, np.ndarray):
+            merged[key] = np.sum(values, axis=0)
+        elif isinstance(first, Detector):
+            # per run tags that differ become columns
+            new_det = detector_union(first.name, *values, sort=False)
+            new_det.primary_energy_col = first.primary_energy_col
+            new_det.primary_time_col = first.primary_time_col
+            new_det._parent_detectors = first._parent_detectors[:]
+            new_det.livetime = _merge_livetime(values)
+            merged[key] = new_det
+        elif isinstance(first, pl.DataFrame):
+            merged[key] = pl.concat(values, how="vertical_relaxed")
+        else:
+            merged[key] = values
+    return merged
+
+
+class BatchResult:
+    """Holds the outcome of run_batch.
+
+    :param results: per run result dictionaries keyed by filename
+    :param failed: exceptions keyed by the filename that raised them
+    """
+
+    def __init__(
+        self,
+        results: Dict[str, Dict[str, Any]],
+        failed: Dict[str, BaseException],
+    ):
+        self.results = results
+        self.failed = failed
+
+    @property
+    def merged(self) -> Dict[str, Any]:
+        return merge_results(list(self.results.values()))
+
+    def __getitem__(self, item: str) -> Any:
+        return self.merged[item]
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+
+def run_batch(
+    files: Sequence[str],
+    analysis: Analysis,
+    output_dir: Optional[str] = None,
+    max_workers: Optional[int] = None,
+    max_memory: Optional[int] = None,
+    max_runs_per_worker: Optional[int] = None,
+    select: Optional[Callable[[RunSummary], bool]] = None,
+) -> BatchResult:
+    """Apply analysis to every file in files using a process pool.
+
+    If output_dir is given, every finished run is saved there and
+    runs with a saved result are loaded instead of being analysed
+    again. Calling run_batch a second time with the same output_dir
+    therefore only retries the runs that failed.
+
+    :param files: run filenames
+    :param analysis: callable (or sequence of callables) returning a dict
+    :param output_dir: directory for partial results
+    :param max_workers: number of worker processes
+    :param max_memory: address space limit per worker in bytes (unix only)
+    :param max_runs_per_worker: restart a worker after this many runs (python >= 3.11)
+    :param select: only analyse runs whose RunSummary passes this test,
+        see sauce.summary
+    :returns: BatchResult
+    """
+    if select is not None:
+        files = [f for f in files if select(summarize_run(f))]
+    results: Dict[str, Dict[str, Any]] = {}
+    failed: Dict[str, BaseException] = {}
+    todo = []
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    for filename in files:
+        if output_dir is not None and os.path.exists(
+            _partial_name(output_dir, filename)
+        ):
+            with open(_partial_name(output_dir, filename), "rb") as f:
+                results[filename] = pickle.load(f)
+        else:
+            todo.append(filename)
+
+    pool_kwargs: Dict[str, Any] = {
+        "max_workers": max_workers,
+        "initializer": _worker_init,
+        "initargs": (max_memory,),
+        # polars is multithreaded and is not fork safe
+        "mp_context": multiprocessing.get_context("spawn"),
+    }
+    if max_runs_per_worker is not None and sys.version_info >= (3, 11):
+        pool_kwargs["max_tasks_per_child"] = max_runs_per_worker
+
+    if todo:
+        with ProcessPoolExecutor(**pool_kwargs) as pool:
+            futures = {
+                pool.submit(_worker, analysis, filename, output_dir): filename
+                for filename in todo
+            }
+            for future in as_completed(futures):
+                filename = futures[future]
+                try:
+                    results[filename] = future.result()
+                except Exception as e:
+                    print("Run {} failed: {}".format(filename, e))
+                    failed[filename] = e
+
+    # keep the order of the input files
+    ordered = {f: results[f] for f in files if f in results}
+    return BatchResult(ordered, failed)
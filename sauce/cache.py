@@ -0,0 +1,264 @@
+"""
+A content addressed on-disk cache for Detector results.
+
+Results are keyed by a hash of the source files (path, size and
+modification time), a description of the operations used to create
+them (gates are hashed by their contents) and the sauce version.
+The data are stored as parquet next to a small json file that
+holds the Detector metadata. When the cache grows past max_size
+the least recently used entries are removed.
+
+Detectors returned from the cache remember their key, so they can
+be used as the source of a later stage. That way editing the last
+step of an analysis only recomputes that step:
+
+.. code-block:: python
+
+   cache = sauce.DetectorCache("~/.sauce_cache", max_size=20e9)
+   si = cache.get_or_compute(
+       lambda: sauce.Detector("si").find_hits(run_file, channel=3),
+       run_file,
+       ops={"find_hits": {"channel": 3}},
+   )
+   si_gated = cache.get_or_compute(
+       lambda: si.copy().apply_gate(gate), si, ops={"gate": gate}
+   )
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+import polars as pl
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+from .detectors import Detector, _plain
+from . import gates
+
+try:
+    from importlib.metadata import version, PackageNotFoundError
+
+    try:
+        sauce_version = version("sauce")
+    except PackageNotFoundError:
+        sauce_version = "unknown"
+except ImportError:
+    sauce_version = "unknown"
+
+
+def _normalize(obj: Any) -> Any:
+    """Turn an operation description into something json can
+    serialize in a repeatable way.
+    """
+    if isinstance(obj, (gates.Gate1D, gates.Gate2D)):
+        return {"gate": type(obj).__name__, **obj._convert_to_dic()}
+    if isinstance(obj, Detector):
+        # a cached Detector that has since been modified in place
+        # no longer matches its key
+        if (
+            getattr(obj, "_cache_key", None) is None
+            or obj.data is not obj._cache_data
+        ):
+            raise ValueError(
+                "Only unmodified Detectors returned by a DetectorCache can be hashed."
+            )
+        return {"detector": obj._cache_key}
+    if isinstance(obj, dict):
+        return {str(k): _normalize(v) for k, v in sorted(obj.items())}
+    if isinstance(obj, (list, tuple)):
+        return [_normalize(v) for v in obj]
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, str) and obj.endswith(".json") and os.path.isfile(obj):
+        # gate files are hashed by what is in them, not their name
+        with open(obj, "rb") as f:
+            return {"json": hashlib.sha256(f.read()).hexdigest()}
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    return repr(obj)
+
+
+def _source_identity(source: Union[str, Detector]) -> Any:
+    if isinstance(source, Detector):
+        return _normalize(source)
+    stat = os.stat(source)
+    return [os.path.abspath(source), stat.st_size, stat.st_mtime_ns]
+
+
+class DetectorCache:
+    """
+    Memoize Detector pipelines on disk.
+
+    :param directory: where cached results are written
+    :param max_size: maximum size of the cache in bytes
+    """
+
+    def __init__(self, directory: str, max_size: Optional[float] = None):
+        self.directory = os.path.expanduser(directory)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(
+        self,
+        sources: Sequence[Union[str, Detector]],
+        ops: Any = None,
+    ) -> str:
+        """Hash the sources, operations and sauce version.
+
+        :param sources: run files (or cached Detectors) the result depends on
+        :param ops: description of the operations, gates, build windows, etc.
+        :returns: hex digest
+        """
+        if isinstance(sources, (str, Detector)):
+            sources = [sources]
+        desc = {
+            "sources": [_source_identity(s) for s in sources],
+            "ops": _normalize(ops),
+            "version": sauce_version,
+        }
+        return hashlib.sha256(
+            json.dumps(desc, sort_keys=True).encode()
+        ).hexdigest()
+
+    def _paths(self, key: str):
+        base = os.path.join(self.directory, key)
+        return base + ".parquet", base + ".json"
+
+    def __contains__(self, key: str) -> bool:
+        return all(os.path.exists(p) for p in self._paths(key))
+
+    def load(self, key: str) -> Detector:
+        data_path, meta_path = self._paths(key)
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        det = Detector(
+            meta["name"],
+            primary_energy_col=meta["primary_energy_col"],
+            primary_time_col=meta["primary_time_col"],
+        )
+        det.livetime = meta["livetime"]
+        det._parent_detectors = meta["parent_detectors"]
+        det.constants = meta.get("constants", {})
+        det.data = pl.read_parquet(data_path)
+        det._cache_key = key
+        det._cache_data = det.data
+        # touching the file marks it as recently used
+        os.utime(data_path)
+        return det
+
+    def store(
+        self, key: str, det: Detector, sources: Sequence[Any] = ()
+    ) -> Detector:
+        data_path, meta_path = self._paths(key)
+        # later stages inherit the run files of the stages they came from
+        # so invalidating a run file removes everything built on it
+        files = [s for s in sources if isinstance(s, str)]
+        for s in sources:
+            parent_meta = self._paths(getattr(s, "_cache_key", ""))[1]
+            if isinstance(s, Detector) and os.path.exists(parent_meta):
+                with open(parent_meta, "r") as f:
+                    files += json.load(f)["sources"]
+        meta = {
+            "name": det.name,
+            "primary_energy_col": det.primary_energy_col,
+            "primary_time_col": det.primary_time_col,
+            "livetime": det.livetime,
+            "parent_detectors": det._parent_detectors,
+            "constants": {k: _plain(v) for k, v in det.constants.items()},
+            "sources": files,
+        }
+        det.data.write_parquet(data_path + ".tmp")
+        os.replace(data_path + ".tmp", data_path)
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+        det._cache_key = key
+        det._cache_data = det.data
+        self.evict()
+        return det
+
+    def get_or_compute(
+        self,
+        compute: Callable[[], Detector],
+        sources: Sequence[Union[str, Detector]],
+        ops: Any = None,
+    ) -> Detector:
+        """Return the cached result if one exists, otherwise call compute
+        and store what it returns.
+
+        :param compute: function with no arguments that returns a Detector
+        :param sources: run files (or cached Detectors) the result depends on
+        :param ops: description of everything else the result depends on
+        :returns: Detector
+        """
+        if isinstance(sources, (str, Detector)):
+            sources = [sources]
+        key = self.key(sources, ops)
+        if key in self:
+            return self.load(key)
+        return self.store(key, compute(), sources)
+
+    def _entries(self) -> List[Dict[str, Any]]:
+        entries = []
+        for f in os.listdir(self.directory):
+            if f.endswith(".parquet"):
+                path = os.path.join(self.directory, f)
+                stat = os.stat(path)
+                entries.append(
+                    {
+                        "key": f[: -len(".parquet")],
+                        "size": stat.st_size,
+                        "used": stat.st_mtime,
+                    }
+                )
+        return entries
+
+    def size(self) -> int:
+        """Total size of the cached data in bytes."""
+        return sum(e["size"] for e in self._entries())
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache is
+        smaller than max_size.
+        """
+        if self.max_size is None:
+            return
+        entries = sorted(self._entries(), key=lambda e: e["used"])
+        total = sum(e["size"] for e in entries)
+        while entries and total > self.max_size:
+            oldest = entries.pop(0)
+            self.invalidate(oldest["key"])
+            total -= oldest["size"]
+
+    def invalidate(
+        self, key: Optional[str] = None, source: Optional[str] = None
+    ):
+        """Remove a single entry by key, or every entry
+        that was built (directly or through an earlier
+        stage) from the given source file.
+
+        :param key: cache key
+        :param source: run file path
+        """
+        keys = []
+        if key is not None:
+            keys.append(key)
+        if source is not None:
+            source = os.path.abspath(source)
+            for e in self._entries():
+                meta_path = self._paths(e["key"])[1]
+                if not os.path.exists(meta_path):
+                    continue
+                with open(meta_path, "r") as f:
+                    sources = json.load(f)["sources"]
+                if source in [os.path.abspath(s) for s in sources]:
+                    keys.append(e["key"])
+        for k in keys:
+            for p in self._paths(k):
+                if os.path.exists(p):
+                    os.remove(p)
+
+    def clear(self):
+        """Remove everything from the cache."""
+        for e in self._entries():
+            self.invalidate(e["key"])
@@ -0,0 +1,175 @@
+"""
+Per channel energy and time calibrations.
+
+A calibration table has one row per channel, keyed by any of
+crate/module/channel, with the coefficients
+
+    energy = offset + gain * adc + quadratic * adc**2
+    time = time + time_offset
+
+Instead of calibrating each Detector with its own with_columns call,
+the table is joined onto the full run so every channel is calibrated
+in a single pass. This works on a Run, a DataFrame or a LazyFrame
+(e.g. from pl.scan_parquet), in which case the calibration is added
+to the query plan and can be streamed.
+"""
+
+import polars as pl
+from typing import Optional, Sequence, Union
+from .run_handling import Run
+from . import config
+
+coefficient_defaults = {
+    "gain": 1.0,
+    "offset": 0.0,
+    "quadratic": 0.0,
+    "time_offset": 0.0,
+}
+
+Frame = Union[pl.DataFrame, pl.LazyFrame]
+
+
+def _schema(data: Frame) -> pl.Schema:
+    if isinstance(data, pl.LazyFrame) and hasattr(data, "collect_schema"):
+        return data.collect_schema()
+    return data.schema
+
+
+class CalibrationTable:
+    """
+    Holds calibration coefficients for many channels.
+
+    :param table: DataFrame with key columns and any of gain, offset,
+        quadratic and time_offset. Missing coefficients take their
+        identity values.
+    :param keys: columns that identify a channel
+    :param energy_col: raw energy column, defaults to config.default_energy_col
+    :param time_col: time column, defaults to config.default_time_col
+    :param calibrated_col: name of the new calibrated energy column
+    """
+
+    def __init__(
+        self,
+        table: pl.DataFrame,
+        keys: Sequence[str] = ("crate", "module", "channel"),
+        energy_col: Optional[str] = None,
+        time_col: Optional[str] = None,
+        calibrated_col: str = "energy",
+    ):
+        self.keys = [k for k in keys if k in table.columns]
+        if not self.keys:
+            raise ValueError(
+                "Calibration table has none of the key columns {}.".format(
+                    list(keys)
+                )
+            )
+        self.energy_col = (
+            energy_col if energy_col else config.default_energy_col
+        )
+        self.time_col = time_col if time_col else config.default_time_col
+        self.calibrated_col = calibrated_col
+        self.table = table.select(
+            self.keys
+            + [
+                (
+                    pl.col(c).cast(pl.Float64)
+                    if c in table.columns
+                    else pl.lit(v, dtype=pl.Float64).alias(c)
+                )
+                for c, v in coefficient_defaults.items()
+            ]
+        ).unique(subset=self.keys, keep="last", maintain_order=True)
+
+    @classmethod
+    def load(cls, filename: str, **kwargs) -> "CalibrationTable":
+        """Read a calibration table from a csv, parquet or feather file.
+
+        :param filename: path to the table
+        :returns: CalibrationTable
+        """
+        if ".csv" in filename:
+            table = pl.read_csv(filename)
+        elif ".parquet" in filename:
+            table = pl.read_parquet(filename)
+        elif ".feather" in filename:
+            table = pl.read_ipc(filename)
+        else:
+            raise (FileNotFoundError)
+        return cls(table, **kwargs)
+
+    def _calibrate(self, data: Frame) -> Frame:
+        schema = _schema(data)
+        missing = [k for k in self.keys if k not in schema]
+        if missing:
+            raise KeyError(
+                "Data is missing calibration key columns {}.".format(missing)
+            )
+        # match key dtypes so the join does not need to cast the data
+        table = self.table.with_columns(
+            [pl.col(k).cast(schema[k]) for k in self.keys]
+        )
+        if isinstance(data, pl.LazyFrame):
+            table = table.lazy()
+        exprs = []
+        if self.energy_col in schema:
+            x = pl.col(self.energy_col)
+            exprs.append(
+                (
+                    pl.col("offset")
+                    + pl.col("gain") * x
+                    + pl.col("quadratic") * x * x
+                ).alias(self.calibrated_col)
+            )
+        if self.time_col in schema:
+            # channels without a time offset are left unchanged
+            time_offset = pl.col("time_offset").fill_null(0.0)
+            time_dtype = schema[self.time_col]
+            if time_dtype.is_integer():
+                # whole ticks, a cast alone would truncate toward zero.
+                # The shift is done in Int64 so negative offsets work
+                # on unsigned tick columns too.
+                shifted = pl.col(self.time_col).cast(
+                    pl.Int64
+                ) + time_offset.round().cast(pl.Int64)
+            else:
+                shifted = pl.col(self.time_col) + time_offset.cast(time_dtype)
+            exprs.append(shifted.cast(time_dtype).alias(self.time_col))
+        data = (
+            data.join(table, on=self.keys, how="left")
+            .with_columns(exprs)
+            .drop(list(coefficient_defaults))
+        )
+        # joins do not promise to keep the row order, and time offsets
+        # can reorder hits anyway
+        if self.time_col in schema:
+            data = data.sort(self.time_col)
+        return data
+
+    def apply(
+        self, data: Union[Run, pl.DataFrame, pl.LazyFrame, str]
+    ) -> Union[Run, pl.DataFrame, pl.LazyFrame]:
+        """Calibrate all channels at once. Runs are modified in place,
+        frames are returned and file paths are scanned and returned as
+        a LazyFrame. Channels not found in the table get a null
+        calibrated energy. Detectors from find_hits no longer have the
+        key columns, so calibrate the run before selecting detectors.
+
+        :param data: Run, DataFrame, LazyFrame or file path
+        :returns: calibrated data
+        """
+        if isinstance(data, Run):
+            data.data = self._calibrate(data.data)
+            return data
+        if isinstance(data, str):
+            if ".csv" in data:
+                data = pl.scan_csv(data)
+            elif ".parquet" in data:
+                data = pl.scan_parquet(data)
+            elif ".feather" in data:
+                data = pl.scan_ipc(data)
+            else:
+                raise (FileNotFoundError)
+        return self._calibrate(data)
+
+    def __len__(self) -> int:
+        return len(self.table)
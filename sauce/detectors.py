@@ -4,12 +4,17 @@ This file helps map the data to actual detectors and group them.
 -Caleb Marshall, Ohio University 2022
 """
 
+import os
+import json
 import numpy as np
 from matplotlib.path import Path
 from numpy.typing import NDArray
 from .run_handling import Run
 from . import config
 from . import gates
+from . import reductions
+from . import monitoring
+from . import summary
 import numba as nb
 import polars as pl
 from typing import Any, Optional, Type, Sequence, Union, List, Tuple
@@ -17,8 +22,29 @@ from typing_extensions import Self
 from functools import singledispatchmethod
 
 
+def tick_times(times: NDArray[Any]) -> NDArray[Any]:
+    """Time stamps ready for window arithmetic. Unsigned integer
+    ticks become int64 so negative window offsets work, everything
+    else (signed integers, floats) is returned as is.
+    """
+    if np.issubdtype(times.dtype, np.unsignedinteger):
+        return times.astype(np.int64)
+    return times
+
+
+def tick_window(times: NDArray[Any], low: float, high: float):
+    """Window edges in the units of times. For integer ticks
+    t + low <= hit <= t + high selects the same hits as
+    t + ceil(low) <= hit <= t + floor(high), so integer
+    time stamps never have to be converted to floats.
+    """
+    if np.issubdtype(times.dtype, np.integer):
+        return int(np.ceil(low)), int(np.floor(high))
+    return low, high
+
+
 @nb.njit
-def referenceless_event_sort(times, build_window) -> NDArray[np.float64]:
+def referenceless_event_sort(times, build_window) -> NDArray[np.int64]:
     """Produce an array with event number.
 
     The event number is based on a simple build
@@ -31,8 +57,7 @@ def referenceless_event_sort(times, build_window) -> NDArray[np.float64]:
     t_i = times[0]
     t_f = t_i + build_window
     event = 0
-    event_number = np.empty(len(times))
-    event_number[:] = np.nan
+    event_number = np.empty(len(times), dtype=np.int64)
 
     for i in range(len(times)):
         tc = times[i]
@@ -70,8 +95,12 @@ class Detector:
         self._coin = True
         self._parent_detectors = []  # will be used by the event builder
         self.livetime = 1.0
+        # columns that hold a single value for every row, see compact
+        self.constants = {}
 
-    def find_hits(self, run_data: Union[str, Run], **kwargs) -> Self:
+    def find_hits(
+        self, run_data: Union[str, Run], compact: bool = False, **kwargs
+    ) -> Self:
         """
         After more usage, I think it is useful to either
         load the entire run (detailed analysis) or
@@ -80,6 +109,8 @@ class Detector:
         As such this function is now more general, and
         calls two other methods to select the data depending
         on whether a Run object is passed or a path to an h5 file.
+
+        If compact is True, Detector.compact is called on the result.
         """
 
         if isinstance(run_data, Run):
@@ -89,6 +120,8 @@ class Detector:
         else:
             print("Only Run objects or csv_file paths accepted!")
         self.data = self.data.sort(by=self.primary_time_col)
+        if compact:
+            self.compact()
         return self
 
     def _hits_from_run(self, run_obj: Run, **kwargs) -> pl.DataFrame:
@@ -111,11 +144,18 @@ class Detector:
             temp_scan = pl.scan_ipc(run_str)
         else:
             raise (FileNotFoundError)
-        return (
-            temp_scan.filter(**kwargs)
-            .drop([k for k, _ in kwargs.items()])
-            .collect(streaming=True)
+        temp_scan = temp_scan.filter(**kwargs).drop(
+            [k for k, _ in kwargs.items()]
         )
+        # a summary sidecar tells us if there is anything to read
+        run_summary = summary.cached_summary(run_str)
+        if (
+            run_summary is not None
+            and all(k in run_summary.keys for k in kwargs)
+            and not run_summary.has_hits(**kwargs)
+        ):
+            return temp_scan.limit(0).collect()
+        return temp_scan.collect(streaming=True)
 
     def _col_cond(self, col: Optional[str]) -> str:
         if col == None:
@@ -133,17 +173,13 @@ class Detector:
         self, threshold: float, col: Optional[str] = None
     ) -> Self:
         col = self._col_cond(col)
-        self.data = self.data.filter(pl.col(col) > threshold)
-        return self
+        return self.filter(pl.col(col) > threshold)
 
     def apply_cut(
         self, cut: Sequence[float], col: Optional[str] = None
     ) -> Self:
         col = self._col_cond(col)
-        self.data = self.data.filter(
-            (pl.col(col) > cut[0]) & (pl.col(col) < cut[1])
-        )
-        return self
+        return self.filter((pl.col(col) > cut[0]) & (pl.col(col) < cut[1]))
 
     def apply_poly_cut(self, cut2d: gates.Gate2D) -> Self:
         """
@@ -155,10 +191,51 @@ class Detector:
         y_col = cut2d.y_col
 
         poly = Path(points, closed=True)
-        results = poly.contains_points(self.data[[x_col, y_col]])
+        results = poly.contains_points(
+            np.column_stack((self[x_col].to_numpy(), self[y_col].to_numpy()))
+        )
         self.data = self.data.filter(results)
         return self
 
+    def veto(
+        self,
+        veto_det: Union["Detector", pl.Series, NDArray[Any]],
+        low: float,
+        high: float,
+        col: Optional[str] = None,
+        drop: bool = True,
+    ) -> Self:
+        """Anti-coincidence without event building. A hit is vetoed
+        if the veto detector has a hit with veto time - hit time in
+        [low, high]. Both time arrays need to be sorted.
+
+        :param veto_det: veto Detector, or its sorted timestamps
+        :param low: lower edge of the window
+        :param high: upper edge of the window
+        :param col: time column
+        :param drop: if True drop vetoed hits, otherwise add a boolean "vetoed" column
+        :returns:
+        """
+        col = self._time_col_cond(col)
+        if isinstance(veto_det, Detector):
+            veto_times = veto_det.data[veto_det.primary_time_col].to_numpy()
+        elif isinstance(veto_det, pl.Series):
+            veto_times = veto_det.to_numpy()
+        else:
+            veto_times = np.asarray(veto_det)
+        veto_times = tick_times(veto_times)
+        times = tick_times(self.data[col].to_numpy())
+        low, high = tick_window(times, low, high)
+        # a window holds a veto hit if the insertion points of its edges differ
+        vetoed = np.searchsorted(veto_times, times + low, "left") != (
+            np.searchsorted(veto_times, times + high, "right")
+        )
+        if drop:
+            self.data = self.data.filter(~vetoed)
+        else:
+            self.data = self.data.with_columns(pl.Series("vetoed", vetoed))
+        return self
+
     def hist(
         self,
         lower: float,
@@ -167,14 +244,20 @@ class Detector:
         col: Optional[str] = None,
         centers: bool = True,
         norm: float = 1.0,
+        weight_col: Optional[str] = None,
     ) -> Tuple[NDArray[Any], NDArray[Any]]:
         """
         Return a histrogram of the given col.
+        Pass weight_col="weight" for a random subtracted spectrum
+        from a Coincident built with background windows.
         """
         col = self._col_cond(col)
 
         counts, bin_edges = np.histogram(
-            self.data.select(col), bins=bins, range=(lower, upper)
+            self[col].to_numpy(),
+            bins=bins,
+            range=(lower, upper),
+            weights=self[weight_col].to_numpy() if weight_col else None,
         )
         # to make fitting data
         if centers:
@@ -184,9 +267,14 @@ class Detector:
             return counts / norm, bin_edges
 
     def __getitem__(self, item: str) -> pl.Series:
+        if isinstance(item, str) and item in self.constants:
+            return pl.repeat(
+                self.constants[item], len(self.data), eager=True
+            ).alias(item)
         return self.data.__getitem__(item)
 
     def __setitem__(self, item: str, value: Any) -> pl.DataFrame:
+        self.constants.pop(item, None)
         self.data = self.data.with_columns(pl.lit(value).alias(item))
         return self.data
 
@@ -213,24 +301,49 @@ class Detector:
     def copy(self) -> Self:
         """Copy data from detector into new detector instance.
 
+        DataFrame.clone is cheap, the new frame shares the column
+        buffers of the old one, so only columns that are later added
+        or modified on either detector allocate new memory. Livetime,
+        parent detectors and constants are carried over.
+
         :returns: Copied instance of detector
 
         """
-        new_det = Detector(self.name)
+        new_det = Detector(
+            self.name,
+            primary_energy_col=self.primary_energy_col,
+            primary_time_col=self.primary_time_col,
+        )
         new_det.data = self.data.clone()
+        new_det.livetime = self.livetime
+        new_det._parent_detectors = self._parent_detectors[:]
+        new_det.constants = self.constants.copy()
         return new_det
 
-    def tag(self, tag: Any, tag_name: str = "tag") -> Self:
-        """Create a tag column in the dataframe.
+    def tag(
+        self, tag: Any, tag_name: str = "tag", column: bool = False
+    ) -> Self:
+        """Tag the detector with a constant value.
         Examples could be run number, a simple index, or
         any other desired information.
 
+        The tag is stored in self.constants instead of a full
+        column. The Detector methods (filter, with_columns, cuts,
+        gates, hist and det[tag_name]) treat it like a column, it
+        survives detector_union and coincidence building, and it is
+        only turned into a column when needed. det.data is the raw
+        frame and does not hold it, use expand_constants for that.
+
         :param tag:
         :param tag_name:
+        :param column: if True, add the tag as a column right away
         :returns:
 
         """
-        self.data = self.data.with_columns(pl.lit(tag).alias(tag_name))
+        if column:
+            self.data = self.data.with_columns(pl.lit(tag).alias(tag_name))
+        else:
+            self.constants[tag_name] = _plain(tag)
         return self
 
     def build_referenceless_events(
@@ -243,9 +356,11 @@ class Detector:
         :returns:
         """
         time_col = self._time_col_cond(col)
-        evt_id = referenceless_event_sort(
-            self.data[time_col].to_numpy(), build_window
-        )
+        times = tick_times(self.data[time_col].to_numpy())
+        if np.issubdtype(times.dtype, np.integer):
+            # hits are in [t, t + build_window), the same as t + ceil(build_window)
+            build_window = int(np.ceil(build_window))
+        evt_id = referenceless_event_sort(times, build_window)
         col_name = "event_" + self.name
         # add event id column
         self.data = self.data.with_columns(
@@ -269,36 +384,352 @@ class Detector:
         )
         return self
 
-    def save(self, filename, file_type: str = "parquet") -> Self:
-        if file_type == "parquet":
-            self.data.write_parquet(filename)
-        elif file_type == "feather":
-            self.data.write_ipc(filename)
-        elif file_type == "csv":
-            self.data.write_csv(filename)
-        else:
-            print(
-                "File type {} not recongnized. Try: parquet, feather, or csv.".format(
-                    file_type
-                )
-            )
+    def _event_col(self, event_col: Optional[str]) -> str:
+        if event_col:
+            return event_col
+        for c in ("event_" + self.name, "event"):
+            if c in self.data.columns:
+                return c
+        raise Exception(
+            "No event column found, build events first or pass event_col."
+        )
+
+    def _event_starts(self, event_col: Optional[str]) -> NDArray[np.int64]:
+        return reductions.event_starts(
+            self.data[self._event_col(event_col)].to_numpy()
+        )
+
+    def _reduce_values(self, col: str) -> NDArray[Any]:
+        x = self.data[col].to_numpy()
+        # sums of small integer types would overflow
+        if np.issubdtype(x.dtype, np.integer):
+            return x.astype(np.int64)
+        return x.astype(np.float64)
+
+    def sum_energy(
+        self, col: Optional[str] = None, event_col: Optional[str] = None
+    ) -> Self:
+        """Reduce each event to its first hit, with col replaced
+        by the sum over all hits in the event.
+
+        :param col: column to sum, defaults to primary_energy_col
+        :param event_col: defaults to event_<name> or event
+        :returns:
+        """
+        col = self._col_cond(col)
+        starts = self._event_starts(event_col)
+        sums = reductions.event_sum(starts, self._reduce_values(col))
+        self.data = self.data[starts[:-1]].with_columns(pl.Series(col, sums))
         return self
 
-    def load(self, filename) -> Self:
-        file_type = filename.split(".")[-1]
+    def first_hit(self, event_col: Optional[str] = None) -> Self:
+        """Keep only the first hit of each event.
 
-        if file_type == "parquet":
-            self.data = pl.read_parquet(filename)
-        elif file_type == "feather":
-            self.data = pl.read_ipc(filename)
-        elif file_type == "csv":
-            self.data = pl.read_csv(filename)
-        else:
+        :param event_col: defaults to event_<name> or event
+        :returns:
+        """
+        starts = self._event_starts(event_col)
+        self.data = self.data[starts[:-1]]
+        return self
+
+    def max_hit(
+        self, col: Optional[str] = None, event_col: Optional[str] = None
+    ) -> Self:
+        """Keep only the hit with the largest col in each event.
+
+        :param col: defaults to primary_energy_col
+        :param event_col: defaults to event_<name> or event
+        :returns:
+        """
+        col = self._col_cond(col)
+        starts = self._event_starts(event_col)
+        index = reductions.event_argmax(starts, self.data[col].to_numpy())
+        self.data = self.data[index]
+        return self
+
+    def hit_pattern(
+        self,
+        strip_col: str,
+        event_col: Optional[str] = None,
+        alias: str = "pattern",
+    ) -> Self:
+        """Add a UInt64 column where bit i is set if strip i was
+        hit anywhere in the event. Strips must be numbered 0-63.
+
+        :param strip_col: column with the strip number
+        :param event_col: defaults to event_<name> or event
+        :param alias: name of the new column
+        :returns:
+        """
+        starts = self._event_starts(event_col)
+        masks = reductions.event_bitmask(
+            starts, self.data[strip_col].to_numpy().astype(np.int64)
+        )
+        self.data = self.data.with_columns(
+            pl.Series(alias, np.repeat(masks, np.diff(starts)))
+        )
+        return self
+
+    def addback(
+        self,
+        strip_col: str,
+        col: Optional[str] = None,
+        event_col: Optional[str] = None,
+        gap: int = 1,
+    ) -> Self:
+        """Neighbour addback for clovers and segmented detectors.
+        Hits in the same event whose strip numbers are at most gap
+        apart are merged into one hit. The merged hit keeps the
+        columns of its highest energy hit, with col replaced by the
+        summed energy.
+
+        :param strip_col: column with the strip (or crystal) number
+        :param col: energy column, defaults to primary_energy_col
+        :param event_col: defaults to event_<name> or event
+        :param gap: largest strip difference that is added back
+        :returns:
+        """
+        col = self._col_cond(col)
+        starts = self._event_starts(event_col)
+        keep, summed = reductions.event_addback(
+            starts,
+            self.data[strip_col].to_numpy().astype(np.int64),
+            self._reduce_values(col),
+            gap,
+        )
+        self.data = self.data[keep].with_columns(pl.Series(col, summed))
+        return self
+
+    def _time_bins(self, bin_width, time_col, start=None, stop=None):
+        times = tick_times(self.data[self._time_col_cond(time_col)].to_numpy())
+        edges, starts = monitoring.time_bins(times, bin_width, start, stop)
+        return times, edges, starts
+
+    def rate(
+        self,
+        bin_width: float,
+        time_col: Optional[str] = None,
+        start: Optional[float] = None,
+        stop: Optional[float] = None,
+        centers: bool = True,
+    ) -> Tuple[NDArray[Any], NDArray[Any]]:
+        """Counts per time bin. The return values follow Detector.hist.
+
+        :param bin_width: width of a time bin, in time column units
+        :param time_col: defaults to primary_time_col
+        :param start: first bin edge, defaults to the first hit
+        :param stop: last bin edge, defaults to the last hit
+        :param centers: if True return (bin low edges, counts), else (counts, edges)
+        """
+        _, edges, starts = self._time_bins(bin_width, time_col, start, stop)
+        counts = np.diff(starts)
+        if centers:
+            return edges[:-1], counts
+        return counts, edges
+
+    def drift(
+        self,
+        bin_width: float,
+        lower: float = -np.inf,
+        upper: float = np.inf,
+        col: Optional[str] = None,
+        time_col: Optional[str] = None,
+    ) -> pl.DataFrame:
+        """Centroid and width of col in every time bin, to follow
+        gain drifts. Use lower and upper to pick out a single peak.
+
+        :param bin_width: width of a time bin, in time column units
+        :param lower: lowest value of col used
+        :param upper: highest value of col used
+        :param col: defaults to primary_energy_col
+        :param time_col: defaults to primary_time_col
+        :returns: DataFrame with time (bin low edge), counts, centroid and width
+        """
+        col = self._col_cond(col)
+        _, edges, starts = self._time_bins(bin_width, time_col)
+        counts, mean, std = monitoring.bin_moments(
+            starts, self.data[col].to_numpy().astype(np.float64), lower, upper
+        )
+        return pl.DataFrame(
+            {
+                "time": edges[:-1],
+                "counts": counts,
+                "centroid": mean,
+                "width": std,
+            }
+        )
+
+    def time_hist(
+        self,
+        bin_width: float,
+        lower: float,
+        upper: float,
+        bins: int,
+        col: Optional[str] = None,
+        time_col: Optional[str] = None,
+    ) -> Tuple[NDArray[Any], NDArray[Any], NDArray[Any]]:
+        """2D histogram of col versus time.
+
+        :param bin_width: width of a time bin, in time column units
+        :param lower: lower edge of col
+        :param upper: upper edge of col
+        :param bins: number of col bins
+        :returns: counts with shape (time bins, bins), time edges, col edges
+        """
+        col = self._col_cond(col)
+        _, edges, starts = self._time_bins(bin_width, time_col)
+        counts = monitoring.bin_time_energy(
+            starts, self.data[col].to_numpy(), lower, upper, bins
+        )
+        return counts, edges, np.linspace(lower, upper, bins + 1)
+
+    def good_time_intervals(
+        self,
+        bin_width: float,
+        min_counts: Optional[float] = None,
+        fraction: float = 0.5,
+        time_col: Optional[str] = None,
+    ) -> NDArray[Any]:
+        """Time intervals without beam trips or dead periods. A time bin
+        is good if it has at least min_counts hits, which defaults to
+        fraction times the median of the non-empty bins. Neighbouring
+        good bins are merged.
+
+        :param bin_width: width of a time bin, in time column units
+        :param min_counts: fewest hits in a good bin
+        :param fraction: fraction of the median rate used when min_counts is None
+        :param time_col: defaults to primary_time_col
+        :returns: (intervals, 2) array of [start, stop) times
+        """
+        _, edges, starts = self._time_bins(bin_width, time_col)
+        counts = np.diff(starts)
+        if min_counts is None:
+            filled = counts[counts > 0]
+            min_counts = fraction * np.median(filled) if len(filled) else 1
+        return monitoring.intervals_from_bins(edges, counts >= min_counts)
+
+    def apply_time_intervals(
+        self, intervals: NDArray[Any], time_col: Optional[str] = None
+    ) -> Self:
+        """Keep only hits inside the given [start, stop) intervals,
+        for example from good_time_intervals.
+
+        :param intervals: (intervals, 2) array
+        :param time_col: defaults to primary_time_col
+        :returns:
+        """
+        times = tick_times(self.data[self._time_col_cond(time_col)].to_numpy())
+        self.data = self.data.filter(
+            monitoring.interval_mask(times, intervals)
+        )
+        return self
+
+    def _metadata(self, file_type: str) -> dict:
+        return {
+            "name": self.name,
+            "primary_energy_col": self.primary_energy_col,
+            "primary_time_col": self.primary_time_col,
+            "livetime": self.livetime,
+            "parent_detectors": self._parent_detectors,
+            "constants": {k: _plain(v) for k, v in self.constants.items()},
+            "columns": self.data.columns,
+            "file_type": file_type,
+        }
+
+    def save(
+        self,
+        filename,
+        file_type: str = "parquet",
+        compression: Optional[str] = None,
+        row_group_size: Optional[int] = None,
+        chunk_rows: Optional[int] = None,
+        append: bool = False,
+    ) -> Self:
+        """Save the detector data along with its name, primary columns,
+        livetime and parent detectors. The metadata is written as json
+        next to the data (filename + ".json") so that load can restore
+        the full Detector.
+
+        If chunk_rows is given, or append is True, filename is a
+        directory and the data are written as numbered part files of at
+        most chunk_rows rows. Appending adds new parts to an existing
+        directory, so a large detector can be written piece by piece.
+
+        :param filename: file (or directory) to write
+        :param file_type: parquet, feather, or csv
+        :param compression: compression codec passed to polars
+        :param row_group_size: parquet row group size
+        :param chunk_rows: rows per part file
+        :param append: add parts to an existing directory
+        :returns:
+        """
+        if file_type not in file_extensions:
             print(
                 "File type {} not recongnized. Try: parquet, feather, or csv.".format(
                     file_type
                 )
             )
+            return self
+        if not (chunk_rows or append):
+            _write_frame(
+                self.data, filename, file_type, compression, row_group_size
+            )
+            _write_metadata(filename + ".json", self._metadata(file_type))
+            return self
+
+        if os.path.isfile(filename):
+            raise ValueError(
+                "{} is a file, chunked saves need a directory.".format(
+                    filename
+                )
+            )
+        meta_path = os.path.join(filename, metadata_file)
+        parts = _part_files(filename)
+        if append and parts:
+            old_meta = _read_metadata(meta_path)
+            if old_meta["columns"] != self.data.columns:
+                raise ValueError(
+                    "Columns {} do not match the saved columns {}.".format(
+                        self.data.columns, old_meta["columns"]
+                    )
+                )
+            file_type = old_meta["file_type"]
+        else:
+            os.makedirs(filename, exist_ok=True)
+            for f in parts:
+                os.remove(f)
+            parts = []
+        chunk_rows = chunk_rows if chunk_rows else max(len(self.data), 1)
+        start = len(parts)
+        for i, offset in enumerate(range(0, len(self.data), chunk_rows)):
+            part_name = os.path.join(
+                filename,
+                "part-{:05d}.{}".format(start + i, file_extensions[file_type]),
+            )
+            _write_frame(
+                self.data.slice(offset, chunk_rows),
+                part_name,
+                file_type,
+                compression,
+                row_group_size,
+            )
+        _write_metadata(meta_path, self._metadata(file_type))
+        return self
+
+    def load(self, filename, columns: Optional[Sequence[str]] = None) -> Self:
+        """Load data written with save. Metadata saved alongside the
+        data is restored. Only the requested columns are read from disk.
+
+        :param filename: file or chunked directory
+        :param columns: columns to read, defaults to all
+        :returns:
+        """
+        scan = scan_detector(filename, self)
+        if scan is None:
+            return self
+        if columns is not None:
+            scan = scan.select(columns)
+        self.data = scan.collect()
         return self
 
     def counts(self) -> int:
@@ -308,6 +739,120 @@ class Detector:
     def __len__(self) -> int:
         return len(self.data)
 
+    def memory_report(self) -> pl.DataFrame:
+        """Estimated memory used by each column.
+
+        :returns: DataFrame with column, dtype and bytes
+        """
+        return pl.DataFrame(
+            {
+                "column": self.data.columns,
+                "dtype": [str(d) for d in self.data.dtypes],
+                "bytes": [
+                    self.data[c].estimated_size() for c in self.data.columns
+                ],
+            }
+        )
+
+    def compact(
+        self,
+        drop_constants: bool = True,
+        categorical: bool = True,
+        report: bool = False,
+        unsigned: bool = False,
+    ) -> Self:
+        """Reduce the memory used by the data.
+
+        Integer columns (except time columns) are cast to the narrowest
+        signed type that holds their range, float columns to Float32 when that loses nothing, and
+        repeated strings become categorical. Columns with a single value
+        (other than the primary columns) are removed and kept in
+        self.constants; use expand_constants to add them back.
+
+        :param drop_constants: move constant columns into self.constants
+        :param categorical: cast repeated string columns to categorical
+        :param report: print bytes per column before and after
+        :param unsigned: use unsigned types for non-negative columns,
+            only safe if the columns are never subtracted
+        :returns:
+        """
+        if len(self.data) == 0:
+            return self
+        before = self.memory_report()
+        cols = self.data.columns
+        # a single pass for all of the column statistics
+        stats = self.data.select(
+            [pl.col(c).min().alias(c + "_min") for c in cols]
+            + [pl.col(c).max().alias(c + "_max") for c in cols]
+            + [pl.col(c).n_unique().alias(c + "_n") for c in cols]
+            + [pl.col(c).null_count().alias(c + "_null") for c in cols]
+        ).row(0, named=True)
+
+        keep = [self.primary_energy_col, self.primary_time_col]
+        casts = []
+        constants = {}
+        for c, dtype in zip(cols, self.data.dtypes):
+            if (
+                drop_constants
+                and c not in keep
+                and stats[c + "_n"] == 1
+                and stats[c + "_null"] == 0
+            ):
+                constants[c] = stats[c + "_min"]
+            elif c == self.primary_time_col or config.default_time_col in c:
+                # timestamps (including renamed ones from coincidences)
+                # keep their type for the event building arithmetic
+                continue
+            elif dtype.is_integer() and stats[c + "_null"] < len(self.data):
+                casts.append(
+                    pl.col(c).cast(
+                        _narrowest_int(
+                            stats[c + "_min"], stats[c + "_max"], unsigned
+                        )
+                    )
+                )
+            elif dtype == pl.Float64 and self._float32_safe(c):
+                casts.append(pl.col(c).cast(pl.Float32))
+            elif (
+                categorical
+                and dtype == pl.Utf8
+                and stats[c + "_n"] <= len(self.data) // 2
+            ):
+                casts.append(pl.col(c).cast(pl.Categorical))
+        self.data = self.data.drop(list(constants)).with_columns(casts)
+        self.constants.update(constants)
+
+        if report:
+            after = self.memory_report().rename(
+                {"dtype": "new_dtype", "bytes": "new_bytes"}
+            )
+            print(before.join(after, on="column", how="left"))
+            print(
+                "Total: {} -> {} bytes".format(
+                    before["bytes"].sum(), after["new_bytes"].sum()
+                )
+            )
+        return self
+
+    def _float32_safe(self, col: str) -> bool:
+        x = self.data[col]
+        return bool(
+            (x.cast(pl.Float32).cast(pl.Float64) == x).all()
+            or x.null_count() == len(x)
+        )
+
+    def expand_constants(self, names: Optional[Sequence[str]] = None) -> Self:
+        """Add constants back to the data as full columns.
+
+        :param names: constants to expand, defaults to all of them
+        :returns:
+        """
+        names = list(self.constants) if names is None else names
+        self.data = self.data.with_columns(
+            [pl.lit(self.constants.pop(n)).alias(n) for n in names]
+        )
+        return self
+
     @singledispatchmethod
     def apply_gate(self, gate):
         """
@@ -329,12 +874,50 @@ class Detector:
         self.apply_poly_cut(gate)
         return self
 
+    def _constants_used(self, exprs, names=()) -> List[str]:
+        """Constants referenced by the given expressions or names."""
+        used = set(n for n in names if n in self.constants)
+        for e in exprs:
+            if isinstance(e, (list, tuple)):
+                used.update(self._constants_used(e))
+            elif isinstance(e, pl.Expr):
+                used.update(
+                    n for n in e.meta.root_names() if n in self.constants
+                )
+            elif isinstance(e, str) and e in self.constants:
+                used.add(e)
+        return sorted(used)
+
+    def _with_constants(self, used: Sequence[str]) -> pl.DataFrame:
+        return self.data.with_columns(
+            [pl.lit(self.constants[n]).alias(n) for n in used]
+        )
+
     def with_columns(self, *exprs, **named_exprs):
-        self.data = self.data.with_columns(*exprs, **named_exprs)
+        used = self._constants_used(list(exprs) + list(named_exprs.values()))
+        data = self._with_constants(used).with_columns(*exprs, **named_exprs)
+        # constants that were overwritten are real columns now
+        written = [n for n in named_exprs if n in self.constants]
+        for e in exprs:
+            if isinstance(e, pl.Expr):
+                try:
+                    name = e.meta.output_name()
+                except Exception:
+                    continue
+                if name in self.constants:
+                    written.append(name)
+        for n in written:
+            self.constants.pop(n)
+        self.data = data.drop([n for n in used if n not in written])
         return self
 
     def filter(self, *predicates, **constraints):
-        self.data = self.data.filter(*predicates, **constraints)
+        used = self._constants_used(predicates, constraints)
+        self.data = (
+            self._with_constants(used)
+            .filter(*predicates, **constraints)
+            .drop(used)
+        )
         return self
 
     def sort(
@@ -363,18 +946,179 @@ class Detector:
         return self
 
 
+def _plain(value: Any) -> Any:
+    """numpy scalars as python values, so they can be written as json."""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _narrowest_int(low: int, high: int, unsigned: bool = False):
+    """Smallest polars integer type that holds [low, high]. Signed
+    types are used unless unsigned is True, so differences of the
+    column cannot wrap around.
+    """
+    if low is None:
+        return pl.Int8
+    if low >= 0 and (unsigned or high > np.iinfo(np.int64).max):
+        options = [pl.UInt8, pl.UInt16, pl.UInt32, pl.UInt64]
+        np_types = [np.uint8, np.uint16, np.uint32, np.uint64]
+    else:
+        options = [pl.Int8, pl.Int16, pl.Int32, pl.Int64]
+        np_types = [np.int8, np.int16, np.int32, np.int64]
+    for dtype, np_type in zip(options, np_types):
+        info = np.iinfo(np_type)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return options[-1]
+
+
+def _tag_dtype(values: Sequence[Any]):
+    """Compact dtype for a column built from per detector tags."""
+    if all(isinstance(v, str) for v in values):
+        if hasattr(pl, "Enum"):
+            return pl.Enum(sorted(set(values)))
+        return pl.Utf8
+    if all(isinstance(v, (int, np.integer)) for v in values):
+        return _narrowest_int(min(values), max(values))
+    return pl.Series(values).dtype
+
+
+file_extensions = {"parquet": "parquet", "feather": "feather", "csv": "csv"}
+metadata_file = "_detector.json"
+
+
+def _write_frame(data, filename, file_type, compression, row_group_size):
+    if file_type == "parquet":
+        kwargs = {"row_group_size": row_group_size}
+        if compression:
+            kwargs["compression"] = compression
+        data.write_parquet(filename, **kwargs)
+    elif file_type == "feather":
+        if compression:
+            data.write_ipc(filename, compression=compression)
+        else:
+            data.write_ipc(filename)
+    elif file_type == "csv":
+        data.write_csv(filename)
+
+
+def _write_metadata(filename, meta):
+    with open(filename, "w") as f:
+        json.dump(meta, f)
+
+
+def _read_metadata(filename):
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def _part_files(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, f)
+        for f in os.listdir(directory)
+        if f.startswith("part-")
+    )
+
+
+def _scan_file(filename, file_type):
+    if file_type == "parquet":
+        return pl.scan_parquet(filename)
+    elif file_type == "feather":
+        return pl.scan_ipc(filename)
+    elif file_type == "csv":
+        return pl.scan_csv(filename)
+
+
+def scan_detector(
+    filename: str, det: Optional[Detector] = None
+) -> Optional[pl.LazyFrame]:
+    """Lazily open data written by Detector.save. Nothing is read
+    until the returned LazyFrame is collected, so selecting a few
+    columns of a large chunked detector only reads those columns.
+
+    :param filename: file or chunked directory
+    :param det: if given, the saved metadata is restored onto det
+    :returns: LazyFrame
+    """
+    if os.path.isdir(filename):
+        meta_path = os.path.join(filename, metadata_file)
+        meta = _read_metadata(meta_path) if os.path.exists(meta_path) else {}
+        files = _part_files(filename)
+        file_type = meta.get(
+            "file_type", files[0].split(".")[-1] if files else "parquet"
+        )
+    else:
+        meta_path = filename + ".json"
+        meta = _read_metadata(meta_path) if os.path.exists(meta_path) else {}
+        files = [filename]
+        file_type = filename.split(".")[-1]
+
+    if file_type not in file_extensions:
+        print(
+            "File type {} not recongnized. Try: parquet, feather, or csv.".format(
+                file_type
+            )
+        )
+        return None
+
+    if det is not None and meta:
+        det.name = meta["name"]
+        det.primary_energy_col = meta["primary_energy_col"]
+        det.primary_time_col = meta["primary_time_col"]
+        det.livetime = meta["livetime"]
+        det._parent_detectors = meta["parent_detectors"]
+        det.constants = meta.get("constants", {})
+    if not files:
+        return pl.LazyFrame()
+    return pl.concat([_scan_file(f, file_type) for f in files])
+
+
 def detector_union(
-    name: str, *dets: Detector, on: Optional[str] = None
+    name: str, *dets: Detector, on: Optional[str] = None, sort: bool = True
 ) -> Detector:
     """Union different detectors if into a
     new detector called "name"
 
+    Tags shared by all detectors stay tags, tags that
+    differ become compact (enum or narrow integer) columns.
+
     :param name: string, new detector name
+    :param sort: sort the result by on, otherwise keep the order of dets
     :returns: Detector object
 
     """
     if not on:
         on = config.default_time_col
     new_det = Detector(name)
-    new_det.data = pl.concat([d.data.lazy() for d in dets]).sort(on).collect()
+    # constants shared by every detector stay constants, the rest
+    # have to become columns again
+    shared = {
+        k: v
+        for k, v in dets[0].constants.items()
+        if all(k in d.constants and d.constants[k] == v for d in dets)
+    }
+    expand = set(k for d in dets for k in d.constants if k not in shared)
+    dtypes = {
+        k: _tag_dtype([d.constants[k] for d in dets if k in d.constants])
+        for k in expand
+    }
+    frames = []
+    for d in dets:
+        frame = d.data.lazy()
+        exprs = [
+            pl.lit(d.constants.get(k)).cast(dtypes[k]).alias(k)
+            for k in sorted(expand)
+        ]
+        if exprs:
+            frame = frame.with_columns(exprs)
+        frames.append(frame)
+    # compacted detectors may not agree on dtypes
+    union = pl.concat(frames, how="vertical_relaxed")
+    if sort:
+        union = union.sort(on)
+    new_det.data = union.collect()
+    new_det.constants = shared
     return new_det
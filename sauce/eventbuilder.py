@@ -4,7 +4,9 @@ import numpy as np
 import numba as nb
 from . import detectors
 from . import config
-from typing import Any, Optional, Union, List, Tuple
+from .run_handling import iter_run_chunks
+import os
+from typing import Any, Optional, Union, List, Sequence, Tuple
 from typing_extensions import Self
 
 
@@ -36,6 +38,30 @@ def reduce_intervals(low: NDArray[Any], high: NDArray[Any]) -> List[Any]:
     return reject
 
 
+@nb.njit
+def reduce_intervals_after(
+    low: NDArray[Any], high: NDArray[Any], last_high, has_last: bool
+) -> NDArray[np.bool_]:
+    """
+    Same rule as reduce_intervals, but starts from the upper edge
+    of the last window kept in an earlier chunk and returns a
+    mask of the windows to keep.
+    :param low: array of low timestamps
+    :param high: array of high timestamps
+    :param last_high: upper edge of the previous kept window
+    :param has_last: False if no window has been kept yet
+    """
+    keep = np.zeros(len(low), dtype=np.bool_)
+    h = last_high
+    started = has_last
+    for j in range(len(low)):
+        if not started or low[j] > h:
+            keep[j] = True
+            h = high[j]
+            started = True
+    return keep
+
+
 @nb.njit
 def find_coincident_events(
     A: NDArray[Any], B: NDArray[Any], C: NDArray[Any]
@@ -64,10 +90,9 @@ def assign_event_index(
     :param lower:
     :param upper:
     :param data:
-    :returns:
+    :returns: window index of every hit, -1 for hits in no window
     """
-    event_number = np.empty(len(data))
-    event_number[:] = np.nan
+    event_number = np.full(len(data), -1, dtype=np.int64)
     start_index = 0
     len_data = len(data)
     for i in range(len(hit_index)):
@@ -78,13 +103,149 @@ def assign_event_index(
             if l <= data[j] <= h:
                 event_number[j] = hit_num
             elif data[j] < l:
-                event_number[j] = np.nan
+                event_number[j] = -1
             elif data[j] > h:
                 start_index = j
                 break
     return event_number
 
 
+@nb.njit
+def assign_event_index_multi(
+    t0: NDArray[Any],
+    times: NDArray[Any],
+    det_index: NDArray[np.int64],
+    lows: NDArray[Any],
+    highs: NDArray[Any],
+) -> NDArray[np.int64]:
+    """
+    Assign the hits of many detectors, merged into one time ordered
+    array, to events in a single sweep. Detector d is in event k if
+    t0[k] + lows[d] <= time <= t0[k] + highs[d]. Each detector keeps
+    its own pointer into the events, and only its first hit per
+    event is assigned.
+    :param t0: sorted event times
+    :param times: sorted hit times of all detectors
+    :param det_index: detector number of each hit
+    :param lows: window start of each detector relative to t0
+    :param highs: window end of each detector relative to t0
+    :returns: event index of every hit, -1 for no event (or not the first hit)
+    """
+    n_dets = len(lows)
+    n_events = len(t0)
+    ptr = np.zeros(n_dets, dtype=np.int64)
+    last = np.full(n_dets, -1, dtype=np.int64)
+    event_number = np.full(len(times), -1, dtype=np.int64)
+    for i in range(len(times)):
+        d = det_index[i]
+        t = times[i]
+        p = ptr[d]
+        while p < n_events and t0[p] + highs[d] < t:
+            p += 1
+        ptr[d] = p
+        if p < n_events and t >= t0[p] + lows[d] and last[d] != p:
+            event_number[i] = p
+            last[d] = p
+    return event_number
+
+
+@nb.njit
+def assign_slices(
+    starts: NDArray[Any],
+    times: NDArray[Any],
+    step: float,
+    width: float,
+    n_slices: int,
+):
+    """
+    Assign sorted hit times to a row of n_slices windows per event,
+    slice k of event e being [starts[e] + k * step, starts[e] + k * step + width].
+    The slices of neighbouring events may overlap, so a hit can land in
+    several (event, slice) pairs. Only the first hit of every pair is kept.
+    :param starts: sorted start of the first slice of each event
+    :param times: sorted hit times
+    :returns: hit index, event index and slice index of every pair
+    """
+    n_events = len(starts)
+    reach = (n_slices - 1) * step + width
+    last = np.full(n_events, -1, dtype=np.int64)
+    hits = []
+    events = []
+    slices = []
+    j = 0
+    for i in range(len(times)):
+        t = times[i]
+        while j < n_events and starts[j] <= t:
+            j += 1
+        e = j - 1
+        while e >= 0 and t - starts[e] <= reach:
+            k = int((t - starts[e]) // step)
+            # closed float slices share their edges, check the one below too
+            for kk in range(max(k - 1, last[e] + 1), min(k + 1, n_slices)):
+                if t - starts[e] - kk * step <= width:
+                    hits.append(i)
+                    events.append(e)
+                    slices.append(kk)
+                    last[e] = kk
+            e -= 1
+    return (
+        np.array(hits, dtype=np.int64),
+        np.array(events, dtype=np.int64),
+        np.array(slices, dtype=np.int64),
+    )
+
+
+def assign_events(
+    data: pl.DataFrame,
+    col: str,
+    lower: NDArray[Any],
+    upper: NDArray[Any],
+    event_numbers: NDArray[np.int64],
+) -> pl.DataFrame:
+    """Give each hit in data the number of the build window it falls in,
+    drop hits outside every window and keep the first hit per event.
+
+    :param data: hits, sorted by col
+    :param col: time column
+    :param lower: lower edges of the build windows
+    :param upper: upper edges of the build windows
+    :param event_numbers: event number of each window
+    :returns: DataFrame with an Int64 "event" column
+    """
+    det_times = detectors.tick_times(data[col].to_numpy())
+    if len(lower) == 0 or len(det_times) == 0:
+        return data.clear().with_columns(
+            pl.lit(0, dtype=pl.Int64).alias("event")
+        )
+
+    # get indices of events that contain at least one of the detectors time stamps
+    mask = find_coincident_events(lower, upper, det_times)
+    hit_index = np.arange(len(lower))[mask]
+
+    # assign event numbers to every event (if no event give -1)
+    event_number = assign_event_index(hit_index, lower, upper, det_times)
+    # window index -> event number, these differ once windows are vetoed
+    assigned = event_number >= 0
+    event_number[assigned] = event_numbers[event_number[assigned]]
+
+    # drop duplicate events keep first timestamp
+    return (
+        data.lazy()
+        .with_columns(pl.Series("event", event_number, dtype=pl.Int64))
+        .filter(pl.col("event") >= 0)
+        .unique(subset=["event"], keep="first", maintain_order=True)
+        .collect()
+    )
+
+
+def _window_width(times: NDArray[Any], low, high) -> float:
+    """Width of the closed window [low, high]. For integer ticks
+    this is the number of ticks it holds."""
+    if np.issubdtype(times.dtype, np.integer):
+        return float(high - low + 1)
+    return float(high - low)
+
+
 class EventBuilder:
     """
     Construct a builder that takes a
@@ -100,6 +261,18 @@ class EventBuilder:
     low and high are the time before and after
     these events that are considered for correlations.
     They are in units of nanoseconds.
+
+    Off-prompt background windows can be passed to
+    create_build_windows. They are placed around the same
+    reference times as the prompt windows, so a Coincident
+    built from this EventBuilder holds prompt and random
+    coincidences from one pass, labelled by a window column
+    and weighted so that summing the weight column subtracts
+    the randoms. Background windows are cut into slices as wide
+    as the prompt window (a remainder that does not fill a whole
+    slice is not used). Each slice keeps the first hit just like
+    the prompt window does, so a slice of uncorrelated hits fills
+    exactly like the prompt window.
     """
 
     def __init__(self):
@@ -109,6 +282,16 @@ class EventBuilder:
         self.reduced_len = 0.0
         self.timestamps: NDArray[Any] = np.empty(0)
         self.event_numbers = []
+        # detectors whose timestamps define the windows
+        self.reference_names: List[str] = []
+        # (offset from the prompt lower edge, number of slices) of each
+        # background window, slices are slice_step apart
+        self.background: List[Tuple[Any, int]] = []
+        self.slice_step: Any = 0
+        self.slice_width: Any = 0
+        # window label and weight of the prompt window and every slice
+        self.window_labels: NDArray[np.int64] = np.zeros(1, dtype=np.int64)
+        self.weights: NDArray[np.float64] = np.ones(1)
 
     def add_timestamps(
         self, det: Union[detectors.Detector, pl.Series], col=None
@@ -121,22 +304,36 @@ class EventBuilder:
         col = col if col else config.default_time_col
         if isinstance(det, detectors.Detector):
             timestamps = det.data[col].to_numpy()
+            self.reference_names.append(det.name)
         elif isinstance(det, pl.Series):
             timestamps = det.to_numpy()
         else:
             raise TypeError(
                 "Must pass either a sauce.Detector or polars.Series instance."
             )
-        self.timestamps = np.concatenate((self.timestamps, timestamps))
+        timestamps = detectors.tick_times(timestamps)
+        # start from the first array added so integer ticks stay integers
+        if len(self.timestamps) == 0:
+            self.timestamps = timestamps
+        else:
+            self.timestamps = np.concatenate((self.timestamps, timestamps))
         # make sure it is sorted
         self.timestamps = np.sort(self.timestamps)
         return self
 
-    def create_build_windows(self, low: float, high: float) -> Self:
+    def create_build_windows(
+        self,
+        low: float,
+        high: float,
+        background: Sequence[Tuple[float, float]] = (),
+    ) -> Self:
         """Call after all timestamps have been added. Method
         then constructs disjoint intervals with in
         :param low: lower bound of coincident window in nanoseconds
         :param high: upper bound of coincident window in nanoseconds
+        :param background: (low, high) of off-prompt windows for random
+            coincidences, relative to the same times as the prompt window.
+            They must be at least as wide as the prompt window.
         :returns:
         """
         # The low, high arguments are now signed, so check that they make sense
@@ -149,8 +346,9 @@ class EventBuilder:
                 "No timestamps have been added. Call EventBuilder.add_timestamps first."
             )
 
-        low_stamps = np.asarray(self.timestamps) + low
-        high_stamps = np.asarray(self.timestamps) + high
+        low, high = detectors.tick_window(self.timestamps, low, high)
+        low_stamps = self.timestamps + low
+        high_stamps = self.timestamps + high
 
         self.pre_reduced_len = len(self.timestamps)
 
@@ -166,6 +364,44 @@ class EventBuilder:
         self.reduced_len = len(self.lower)
         self.event_numbers = np.arange(self.reduced_len)
 
+        prompt_width = _window_width(self.timestamps, low, high)
+        if np.issubdtype(self.timestamps.dtype, np.integer):
+            self.slice_step = int(prompt_width)
+        else:
+            self.slice_step = prompt_width
+        self.slice_width = high - low
+        self.background = []
+        labels = [0]
+        for label, (b_low, b_high) in enumerate(background, start=1):
+            if b_high <= b_low:
+                raise Exception(
+                    "Invalid background window, high limit is less than low limit."
+                )
+            b_low, b_high = detectors.tick_window(
+                self.timestamps, b_low, b_high
+            )
+            n_slices = int(
+                np.floor(
+                    _window_width(self.timestamps, b_low, b_high)
+                    / prompt_width
+                    + 1e-9
+                )
+            )
+            if n_slices < 1:
+                raise Exception(
+                    "Background windows must be at least as wide as the prompt window."
+                )
+            # slices are placed relative to the prompt lower edges, so
+            # they follow the windows through a veto
+            self.background.append((b_low - low, n_slices))
+            labels += [label] * n_slices
+        self.window_labels = np.array(labels, dtype=np.int64)
+        # every slice is one prompt window wide, so the randoms in the
+        # prompt window are the mean over all slices
+        self.weights = np.ones(len(labels))
+        if self.background:
+            self.weights[1:] = -1.0 / (len(labels) - 1)
+
         self.calc_livetime()
 
         if self.livetime < 0.90:
@@ -180,14 +416,79 @@ class EventBuilder:
         self.livetime = self.reduced_len / self.pre_reduced_len
         return self.livetime
 
+    def _slice_offsets(self) -> NDArray[Any]:
+        """Offset of every background slice from the prompt lower edges."""
+        if not self.background:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(
+            [
+                offset + self.slice_step * np.arange(n_slices)
+                for offset, n_slices in self.background
+            ]
+        )
+
+    def _edges(self, window: int = 0):
+        """Build windows, 0 is prompt and i > 0 is background slice i."""
+        if window == 0:
+            return self.lower, self.upper
+        offset = self._slice_offsets()[window - 1]
+        return self.lower + offset, self.upper + offset
+
+    def vetoed_events(
+        self,
+        det: Union[detectors.Detector, pl.Series],
+        col=None,
+        window: int = 0,
+    ) -> NDArray[np.bool_]:
+        """Boolean mask over the current build windows that is True
+        for every window containing at least one hit of det.
+
+        :param det: veto detector or its sorted timestamps
+        :param window: 0 for the prompt windows, i for background slice i
+        :returns: mask with one entry per build window
+        """
+        col = col if col else config.default_time_col
+        if isinstance(det, detectors.Detector):
+            veto_times = det.data[col].to_numpy()
+        elif isinstance(det, pl.Series):
+            veto_times = det.to_numpy()
+        else:
+            raise TypeError(
+                "Must pass either a sauce.Detector or polars.Series instance."
+            )
+        lower, upper = self._edges(window)
+        return find_coincident_events(
+            lower, upper, detectors.tick_times(veto_times)
+        )
+
+    def veto(
+        self, det: Union[detectors.Detector, pl.Series], col=None
+    ) -> Self:
+        """Remove every build window that contains a hit from det.
+        Event numbers of the remaining windows are unchanged.
+        Call after create_build_windows and before creating a Coincident.
+
+        :param det: veto detector or its sorted timestamps
+        :returns:
+        """
+        keep = ~self.vetoed_events(det, col)
+        self.lower = self.lower[keep]
+        self.upper = self.upper[keep]
+        self.event_numbers = self.event_numbers[keep]
+        return self
+
     def assign_events_to_detector_and_drop(
-        self, det: detectors.Detector, col: Optional[str] = None
+        self,
+        det: detectors.Detector,
+        col: Optional[str] = None,
+        window: int = 0,
     ) -> detectors.Detector:
         """
         For the given detector, look at each event and see if it can be assigned
         to an event based on the time stamp array. Keep only the hit with the earliest timestamp.
 
         :param det: instance of detectors.Detector
+        :param window: 0 for the prompt windows, i for background slice i
         :returns: time filtered detectors.Detector
         """
 
@@ -197,35 +498,385 @@ class EventBuilder:
             )
 
         col = col if col else config.default_time_col
-        det_times = det.data[col].to_numpy()
-
         before_len = len(det.data)
+        lower, upper = self._edges(window)
+        det.data = assign_events(
+            det.data, col, lower, upper, self.event_numbers
+        )
+
+        # drop duplicate events keep first timestamp
+        after_len = len(det.data)
+        det.livetime = after_len / before_len
+
+        return det
+
+    def assign_background(
+        self, det: detectors.Detector, col: Optional[str] = None
+    ) -> pl.DataFrame:
+        """
+        Hits of det in the background slices, found in one sweep over
+        the hits per background window. Like the prompt window, only the
+        first hit of every event and slice is kept.
+
+        :param det: instance of detectors.Detector
+        :returns: rows of det.data with an "event" and a "window"
+            (slice number, starting at 1) column
+        """
+        col = col if col else config.default_time_col
+        times = detectors.tick_times(det.data[col].to_numpy())
+        frames = []
+        first = 1
+        for offset, n_slices in self.background:
+            hits, events, slices = assign_slices(
+                self.lower + offset,
+                times,
+                self.slice_step,
+                self.slice_width,
+                n_slices,
+            )
+            frames.append(
+                det.data[hits].with_columns(
+                    pl.Series("event", self.event_numbers[events]),
+                    pl.Series("window", first + slices),
+                )
+            )
+            first += n_slices
+        return pl.concat(frames)
+
+
+class MultiEventBuilder:
+    """
+    Event builder with a window for every detector and several
+    reference detectors in priority order.
+
+    Reference detectors are added with add_reference, highest priority
+    first. A reference hit that falls inside the window of a higher
+    priority reference hit does not open its own event, so the event
+    time t0 always comes from the highest priority detector present.
+    Every detector (references included) has its own [low, high]
+    window relative to t0, so fast and slow detectors can be built
+    together. Events whose total span overlaps an earlier event are
+    dropped, as in EventBuilder.
 
-        # get indices of events that contain at least one of the detectors time stamps
-        mask = find_coincident_events(self.lower, self.upper, det_times)
-        hit_index = np.arange(len(self.lower))[mask]
+    All attached detectors are assigned in one merged sweep by
+    create_build_windows. The builder can then be used with Coincident
+    just like EventBuilder:
 
-        # assign event numbers to every event (if no event give NaN)
-        event_number = assign_event_index(
-            hit_index, self.lower, self.upper, det_times
+    .. code-block:: python
+
+       eb = MultiEventBuilder()
+       eb.add_reference(mcp, -10, 10)
+       eb.add_reference(si, -50, 50)
+       eb.add_detector(hpge, -500, 1500)
+       eb.create_build_windows()
+       coin = Coincident(eb)
+       mcp_hpge = coin[mcp, hpge]
+    """
+
+    def __init__(self):
+        self.references: List[str] = []
+        self.dets = {}
+        self.windows = {}
+        self.lower: NDArray[Any] = np.empty(0)
+        self.upper: NDArray[Any] = np.empty(0)
+        self.t0: NDArray[Any] = np.empty(0)
+        self.event_numbers: NDArray[np.int64] = np.empty(0, dtype=np.int64)
+        self.pre_reduced_len = 0
+        self.reduced_len = 0
+        self.livetime = 1.0
+        self._assigned = {}
+
+    def add_detector(
+        self, det: detectors.Detector, low: float, high: float
+    ) -> Self:
+        """Attach a detector with its window relative to the event time.
+
+        :param det: Detector
+        :param low: window start relative to t0
+        :param high: window end relative to t0
+        """
+        if high <= low:
+            raise Exception(
+                "Invalid build window, high limit is less than low limit."
+            )
+        self.dets[det.name] = det
+        self.windows[det.name] = (low, high)
+        return self
+
+    def add_reference(
+        self, det: detectors.Detector, low: float, high: float
+    ) -> Self:
+        """Attach a reference detector. References added first have
+        the highest priority.
+
+        :param det: Detector
+        :param low: window start relative to t0
+        :param high: window end relative to t0
+        """
+        self.add_detector(det, low, high)
+        self.references.append(det.name)
+        return self
+
+    def _times(self, name):
+        det = self.dets[name]
+        return detectors.tick_times(det.data[det.primary_time_col].to_numpy())
+
+    def _window(self, name, times):
+        return detectors.tick_window(times, *self.windows[name])
+
+    def create_build_windows(self) -> Self:
+        """Find the event times and assign every attached detector."""
+        if not self.references:
+            raise Exception(
+                "No reference detectors. Call MultiEventBuilder.add_reference first."
+            )
+        # a reference hit inside the window of a kept higher priority
+        # hit is part of that event
+        t0 = None
+        for name in self.references:
+            times = self._times(name)
+            if t0 is None:
+                t0 = times
+                continue
+            low, high = self._window(name, times)
+            absorbed = find_coincident_events(times - high, times - low, t0)
+            t0 = np.sort(np.concatenate((t0, times[~absorbed])))
+
+        # absorbed hits belong to an event, only the overlap
+        # reduction below loses events
+        self.pre_reduced_len = len(t0)
+
+        # events are disjoint over the span of every detector window
+        lows, highs = zip(*[self._window(n, t0) for n in self.dets])
+        span_low = t0 + min(lows)
+        span_high = t0 + max(highs)
+        drop_indx = reduce_intervals(span_low, span_high)
+        self.t0 = np.delete(t0, drop_indx)
+        self.lower = np.delete(span_low, drop_indx)
+        self.upper = np.delete(span_high, drop_indx)
+        self.reduced_len = len(self.t0)
+        self.event_numbers = np.arange(self.reduced_len)
+        self.calc_livetime()
+        if self.livetime < 0.90:
+            print("Warning dead time is greater than 10%!!")
+
+        # one sweep over the merged hits of every detector
+        names = list(self.dets)
+        all_times = [self._times(n) for n in names]
+        times = np.concatenate(all_times)
+        det_index = np.concatenate(
+            [
+                np.full(len(t), i, dtype=np.int64)
+                for i, t in enumerate(all_times)
+            ]
         )
+        order = np.argsort(times, kind="stable")
+        event_sorted = assign_event_index_multi(
+            self.t0,
+            times[order],
+            det_index[order],
+            np.asarray(lows, dtype=times.dtype),
+            np.asarray(highs, dtype=times.dtype),
+        )
+        event_number = np.empty_like(event_sorted)
+        event_number[order] = event_sorted
+        start = 0
+        for name, t in zip(names, all_times):
+            evt = event_number[start : start + len(t)]
+            start += len(t)
+            self._assigned[name] = (
+                self.dets[name]
+                .data.with_columns(pl.Series("event", evt, dtype=pl.Int64))
+                .filter(pl.col("event") >= 0)
+            )
+        return self
 
-        det.data = (
-            det.data.lazy()
-            .with_columns(pl.lit(event_number).alias("event"))
-            .filter(~pl.col("event").is_nan())
-            .unique(subset=["event"], keep="first", maintain_order=True)
-            .with_columns(pl.col("event").cast(pl.Int64))
-            .collect()
+    def calc_livetime(self) -> float:
+        """Fraction of candidate events kept after removing overlaps."""
+        self.livetime = self.reduced_len / self.pre_reduced_len
+        return self.livetime
+
+    def vetoed_events(
+        self, det: Union[detectors.Detector, pl.Series], col=None
+    ) -> NDArray[np.bool_]:
+        """Boolean mask over the events that is True for every event
+        holding a hit of det, using det's own window if it is attached.
+        """
+        if isinstance(det, detectors.Detector) and det.name in self._assigned:
+            mask = np.zeros(len(self.t0), dtype=bool)
+            mask[self._assigned[det.name]["event"].to_numpy()] = True
+            return mask
+        col = col if col else config.default_time_col
+        veto_times = (
+            det.data[col] if isinstance(det, detectors.Detector) else det
+        )
+        return find_coincident_events(
+            self.lower, self.upper, detectors.tick_times(veto_times.to_numpy())
         )
 
-        # drop duplicate events keep first timestamp
-        after_len = len(det.data)
-        det.livetime = after_len / before_len
+    def assign_events_to_detector_and_drop(
+        self, det: detectors.Detector, col: Optional[str] = None
+    ) -> detectors.Detector:
+        """Return det with the events found by create_build_windows.
 
+        :param det: an attached Detector
+        :returns: time filtered detectors.Detector
+        """
+        if det.name not in self._assigned:
+            raise KeyError(
+                "{} was not added to the MultiEventBuilder before create_build_windows.".format(
+                    det.name
+                )
+            )
+        before_len = len(det.data)
+        det.data = self._assigned[det.name]
+        det.livetime = len(det.data) / before_len if before_len else 1.0
         return det
 
 
+class ChunkedEventBuilder:
+    """
+    Build events from data that arrives in time ordered chunks.
+
+    Reference timestamps and detector hits are pushed one chunk at a
+    time. A build window is closed once the newest time seen is past
+    its upper edge (plus lag, to allow for slightly out of order
+    data). Only closed windows are assigned, hits that could still
+    belong to an open window are carried to the next push, and event
+    numbers keep counting across chunks. Memory use is set by the chunk
+    size and the build window, not the length of the run.
+
+    :param low: lower bound of coincident window
+    :param high: upper bound of coincident window
+    :param lag: how far out of time order the data can be
+    :param col: time column, defaults to config.default_time_col
+    """
+
+    def __init__(self, low: float, high: float, lag: float = 0.0, col=None):
+        if high <= low:
+            raise Exception(
+                "Invalid build window, high limit is less than low limit."
+            )
+        self.low = low
+        self.high = high
+        self.lag = lag
+        self.col = col if col else config.default_time_col
+        self.next_event = 0
+        # None until the first window/hit, so no float sentinels
+        # end up in integer tick arithmetic
+        self.last_upper = None
+        self.t_max = None
+        self.pre_reduced_len = 0
+        self.reduced_len = 0
+        self._ref: Optional[NDArray[Any]] = None
+        self._buffers = {}
+
+    def push(
+        self,
+        reference: Union[pl.Series, NDArray[Any]],
+        dets: dict,
+        final: bool = False,
+    ) -> dict:
+        """Add a chunk and assign every window that can be closed.
+
+        :param reference: reference timestamps in this chunk
+        :param dets: detector name -> DataFrame of hits in this chunk
+        :param final: close every remaining window (end of data)
+        :returns: detector name -> hits with a global "event" column,
+            only the first hit of each detector per event is kept
+        """
+        if isinstance(reference, pl.Series):
+            reference = reference.to_numpy()
+        reference = detectors.tick_times(np.sort(reference))
+        # an empty chunk must not change the dtype of the reference times
+        if self._ref is None or len(self._ref) == 0:
+            self._ref = reference
+        elif len(reference):
+            self._ref = np.concatenate((self._ref, reference))
+        if len(reference):
+            self._see(reference[-1])
+        for name, df in dets.items():
+            if len(df):
+                self._see(df[self.col].max())
+            if name in self._buffers:
+                df = pl.concat(
+                    [self._buffers[name], df], how="vertical_relaxed"
+                )
+            self._buffers[name] = df.sort(self.col)
+
+        low, high = detectors.tick_window(self._ref, self.low, self.high)
+        if final:
+            n_closed = len(self._ref)
+        elif self.t_max is None:
+            n_closed = 0
+        else:
+            horizon = self.t_max - self._lag()
+            # a hit tied with the newest time can still arrive in the
+            # next chunk, so a window ending at the horizon stays open
+            n_closed = np.searchsorted(self._ref, horizon - high, "left")
+        closed = self._ref[:n_closed]
+        self._ref = self._ref[n_closed:]
+
+        lower = closed + low
+        upper = closed + high
+        has_last = self.last_upper is not None
+        keep = reduce_intervals_after(
+            lower,
+            upper,
+            self.last_upper if has_last else upper.dtype.type(0),
+            has_last,
+        )
+        lower = lower[keep]
+        upper = upper[keep]
+        self.pre_reduced_len += len(closed)
+        self.reduced_len += len(lower)
+        if len(upper):
+            self.last_upper = upper[-1]
+        event_numbers = np.arange(
+            self.next_event, self.next_event + len(lower)
+        )
+        self.next_event += len(lower)
+
+        results = {}
+        for name, df in self._buffers.items():
+            results[name] = assign_events(
+                df, self.col, lower, upper, event_numbers
+            )
+            self._buffers[name] = self._carry(df, low, final)
+        return results
+
+    def _see(self, t):
+        self.t_max = t if self.t_max is None else max(self.t_max, t)
+
+    def _lag(self):
+        if isinstance(self.t_max, (int, np.integer)):
+            return int(np.ceil(self.lag))
+        return self.lag
+
+    def _carry(self, df: pl.DataFrame, low, final: bool) -> pl.DataFrame:
+        """Hits that can still be assigned to a window that is not
+        closed yet. Nothing before the next window (or inside a
+        closed one) is kept.
+        """
+        if final or self.t_max is None:
+            return df.clear() if final else df
+        horizon = self.t_max - self._lag()
+        if len(self._ref):
+            cutoff = min(self._ref[0], horizon) + low
+        else:
+            cutoff = horizon + low
+        keep = pl.col(self.col) >= cutoff
+        if self.last_upper is not None:
+            keep = keep & (pl.col(self.col) > self.last_upper)
+        return df.filter(keep)
+
+    def calc_livetime(self) -> float:
+        """Fraction of reference hits that opened a window so far."""
+        if self.pre_reduced_len == 0:
+            return 1.0
+        return self.reduced_len / self.pre_reduced_len
+
+
 class Coincident:
     def __init__(self, eb: EventBuilder):
         self.data: pl.DataFrame = pl.DataFrame(
@@ -244,9 +895,94 @@ class Coincident:
                 return col
         return col + "_" + det_name
 
+    def _drop_vetoed(self, data, det, time_col):
+        """Drop rows of data whose event has a hit in det."""
+        vetoed = self.eb.vetoed_events(det, time_col)
+        if len(data) == 0 or not vetoed.any():
+            return data
+        is_vetoed = np.zeros(int(self.eb.event_numbers.max()) + 1, dtype=bool)
+        is_vetoed[self.eb.event_numbers[vetoed]] = True
+        return data.filter(~is_vetoed[data["event"].to_numpy()])
+
     def _shared_columns(self, det1, det2):
         return [col for col in det1.data.columns if col in det2.data.columns]
 
+    def _assign(self, det, time_col, background):
+        """Event assignment of det in the prompt window, and with a
+        window column for the prompt window and every background
+        slice if background is set."""
+        temp_det = self.eb.assign_events_to_detector_and_drop(
+            det.copy(), time_col
+        )
+        if background:
+            temp_det.data = pl.concat(
+                [
+                    temp_det.data.with_columns(
+                        pl.lit(0, dtype=pl.Int64).alias("window")
+                    ),
+                    self.eb.assign_background(det, time_col),
+                ]
+            )
+        return temp_det
+
+    def _join(self, new_det, dets, coin, references):
+        """Inner join of the coincident detectors and removal of the
+        vetoed events. Detectors that are not references are looked for
+        in the background slices too, in which case the result has a
+        window column."""
+        data = self.data
+        vetoes = []
+        has_background = bool(getattr(self.eb, "background", []))
+        for det, is_coin in zip(dets, coin):
+            background = has_background and det not in references
+            # The list comprehension takes care of the case that
+            # happens when a detector is passed that has already had
+            # its columns renamed from event building.
+            time_col = [
+                x for x in det.data.columns if config.default_time_col in x
+            ][0]
+            if not is_coin:
+                # anti-coincidence only needs to know which events hold
+                # a hit, so skip event assignment and the anti join
+                if background:
+                    vetoes.append((det, time_col))
+                else:
+                    data = self._drop_vetoed(data, det, time_col)
+                continue
+            temp_det = self._assign(det, time_col, background)
+            # tags are carried as constants, renamed like the columns
+            for k, v in det.constants.items():
+                new_det.constants[
+                    self._column_name_check(new_det, temp_det.name, k)
+                ] = v
+            temp_data = temp_det.data.rename(
+                {
+                    col: self._column_name_check(new_det, temp_det.name, col)
+                    for col in temp_det.data.columns
+                    if not (background and col == "window")
+                }
+            )
+            on = [col for col in data.columns if col in temp_data.columns]
+            data = data.join(temp_data, on=on, how="inner").sort(
+                by=["event", "window"] if "window" in on else "event"
+            )
+        if vetoes:
+            if "window" not in data.columns:
+                windows = pl.DataFrame(
+                    {"window": np.arange(len(self.eb.weights))}
+                )
+                data = data.join(windows, how="cross").sort(
+                    by=["event", "window"]
+                )
+            for det, time_col in vetoes:
+                hits = self._assign(det, time_col, True).data
+                data = data.join(
+                    hits.select("event", "window"),
+                    on=["event", "window"],
+                    how="anti",
+                )
+        return data
+
     def create_coincidence(
         self, *dets: detectors.Detector, coincident_detector_name=None
     ) -> detectors.Detector:
@@ -260,33 +996,29 @@ class Coincident:
                 new_det._parent_detectors += det._parent_detectors
             else:
                 new_det._parent_detectors.append(det.name)
-        # now we do a inner merge on all the data
-        new_det.data = self.data.clone()
-        for det in dets:
-            # The list comprehension takes care of the case that
-            # happens when a detector is passed that has already had
-            # its columns renamed from event building.
-            temp_det = self.eb.assign_events_to_detector_and_drop(
-                det.copy(),
-                [x for x in det.data.columns if config.default_time_col in x][
-                    0
-                ],
-            )
-            temp_det.data = temp_det.data.rename(
-                {
-                    col: self._column_name_check(new_det, temp_det.name, col)
-                    for col in temp_det.data.columns
-                }
-            )
-            # we do inner joins unless we asked for anti-coincidence
-            how_type = "anti" if not det.get_coin() else "inner"
-
-            new_det.data = new_det.data.join(
-                temp_det.data,
-                on=self._shared_columns(new_det, temp_det),
-                how=how_type,
-            ).sort(by="event")
+        coin = [det.get_coin() for det in dets]
+        if not getattr(self.eb, "background", []):
+            # now we do a inner merge on all the data
+            new_det.data = self._join(new_det, dets, coin, dets)
+            return new_det
 
+        # the detectors that opened the windows stay in the prompt window,
+        # the others are assigned to the prompt window and every
+        # background slice in one pass, then joined once
+        references = [
+            det for det in dets if det.name in self.eb.reference_names
+        ]
+        if not references or len(references) == len(dets):
+            raise Exception(
+                "Background windows need at least one detector whose timestamps "
+                "were added to the EventBuilder and one that was not."
+            )
+        data = self._join(new_det, dets, coin, references)
+        window = data["window"].to_numpy()
+        new_det.data = data.drop("window").with_columns(
+            pl.Series("window", self.eb.window_labels[window], dtype=pl.UInt8),
+            pl.Series("weight", self.eb.weights[window], dtype=pl.Float64),
+        )
         return new_det
 
     def __getitem__(
@@ -303,6 +1035,145 @@ class Coincident:
         return self.create_coincidence(key)
 
 
+class ChunkedCoincident:
+    """
+    Coincidence building for runs that do not fit in memory.
+
+    The run file is read in time ordered chunks of chunk_size rows,
+    events are built with a ChunkedEventBuilder (so windows that
+    straddle a chunk boundary are handled and event numbers are global)
+    and every chunk of coincidences is appended to a chunked Detector
+    directory on disk. Peak memory is set by chunk_size.
+
+    .. code-block:: python
+
+       cc = ChunkedCoincident("big_run.parquet", -500, 500, reference="si")
+       cc.add_detector("si", module=0, channel=3)
+       cc.add_detector("mcp", module=1, channel=0)
+       cc.build("si_mcp", "si", "mcp")
+       si_mcp = sauce.Detector("si_mcp").load("si_mcp", columns=["adc_si"])
+
+    :param filename: run file, written in time order (within lag)
+    :param low: lower bound of the build window
+    :param high: upper bound of the build window
+    :param reference: names of the detectors whose hits open windows,
+        defaults to the first detector added
+    :param chunk_size: rows read per chunk
+    :param lag: how far out of time order the file can be
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        low: float,
+        high: float,
+        reference: Optional[Union[str, List[str]]] = None,
+        chunk_size: int = 1_000_000,
+        lag: float = 0.0,
+    ):
+        self.filename = filename
+        self.low = low
+        self.high = high
+        self.reference = (
+            [reference] if isinstance(reference, str) else reference
+        )
+        self.chunk_size = chunk_size
+        self.lag = lag
+        self.selections = {}
+        self.livetime = 1.0
+
+    def add_detector(self, name: str, **kwargs) -> Self:
+        """Define a detector by the same column constraints
+        used in Detector.find_hits."""
+        self.selections[name] = kwargs
+        return self
+
+    def _select(self, chunk: pl.DataFrame, name: str) -> pl.DataFrame:
+        kwargs = self.selections[name]
+        return chunk.filter(**kwargs).drop(list(kwargs))
+
+    def build(
+        self,
+        output: str,
+        *names: str,
+        veto: Sequence[str] = (),
+        file_type: str = "parquet",
+    ) -> pl.LazyFrame:
+        """Make one pass over the run and write the coincidences of
+        the named detectors to output. Columns are named as in
+        Coincident.create_coincidence (adc_si, evt_ts_mcp, ...).
+
+        :param output: directory for the chunked result
+        :param names: detectors that must all be in an event
+        :param veto: detectors that must not be in an event
+        :param file_type: parquet, feather, or csv
+        :returns: LazyFrame over the written result
+        """
+        time_col = config.default_time_col
+        reference = self.reference if self.reference else [names[0]]
+        used = list(dict.fromkeys(list(names) + list(veto) + reference))
+        eb = ChunkedEventBuilder(
+            self.low, self.high, lag=self.lag, col=time_col
+        )
+        out_det = detectors.Detector("_".join(names))
+        out_det._parent_detectors = list(names)
+        written = False
+
+        chunks = iter_run_chunks(self.filename, self.chunk_size)
+        chunk = next(chunks, None)
+        while chunk is not None:
+            next_chunk = next(chunks, None)
+            dets = {name: self._select(chunk, name) for name in used}
+            ref_times = np.sort(
+                np.concatenate(
+                    [dets[name][time_col].to_numpy() for name in reference]
+                )
+            )
+            assigned = eb.push(ref_times, dets, final=next_chunk is None)
+            coin = self._join(assigned, names, veto)
+            if len(coin):
+                out_det.data = coin
+                out_det.save(
+                    output,
+                    file_type=file_type,
+                    chunk_rows=len(coin),
+                    append=written,
+                )
+                written = True
+            chunk = next_chunk
+
+        if not written:
+            out_det.data = pl.DataFrame()
+            out_det.save(output, file_type=file_type, chunk_rows=1)
+        # the metadata is rewritten with the livetime of the whole run
+        self.livetime = eb.calc_livetime()
+        out_det.livetime = self.livetime
+        detectors._write_metadata(
+            os.path.join(output, detectors.metadata_file),
+            out_det._metadata(file_type),
+        )
+        return detectors.scan_detector(output)
+
+    @staticmethod
+    def _join(assigned, names, veto) -> pl.DataFrame:
+        frames = [
+            assigned[n].rename(
+                {c: c + "_" + n for c in assigned[n].columns if c != "event"}
+            )
+            for n in names
+        ]
+        coin = frames[0]
+        for f in frames[1:]:
+            coin = coin.join(f, on="event", how="inner")
+        for n in veto:
+            coin = coin.join(
+                assigned[n].select("event"), on="event", how="anti"
+            )
+        return coin.select(
+            ["event"] + [c for c in coin.columns if c != "event"]
+        ).sort("event")
+
+
 def make_coincidence(dets, lower: float, upper: float):
     eb = EventBuilder()
     if isinstance(dets, list):
@@ -3,6 +3,7 @@ from matplotlib.path import Path
 from matplotlib import pyplot as plt
 import matplotlib.patches as patches
 import json
+import numba as nb
 import polars as pl
 import time
 
@@ -21,6 +22,235 @@ def maybe_close_polygon(points):
     return new_points
 
 
+@nb.njit(parallel=True, cache=True)
+def bin_1d(x, low, high, bins, n_chunks):
+    """Multi-threaded histogram of x on [low, high].
+    Each thread fills its own histogram, which are summed at the end.
+    """
+    counts = np.zeros((n_chunks, bins), dtype=np.int64)
+    n = len(x)
+    chunk = (n + n_chunks - 1) // n_chunks
+    scale = bins / (high - low)
+    for c in nb.prange(n_chunks):
+        for i in range(c * chunk, min((c + 1) * chunk, n)):
+            xi = x[i]
+            if xi >= low and xi <= high:
+                counts[c, min(int((xi - low) * scale), bins - 1)] += 1
+    return counts.sum(axis=0)
+
+
+@nb.njit(parallel=True, cache=True)
+def bin_2d(x, y, x_low, x_high, y_low, y_high, nx, ny, n_chunks):
+    """Multi-threaded 2D histogram, returned as (ny, nx) so it
+    can be passed straight to imshow.
+    """
+    counts = np.zeros((n_chunks, ny, nx), dtype=np.int64)
+    n = len(x)
+    chunk = (n + n_chunks - 1) // n_chunks
+    sx = nx / (x_high - x_low)
+    sy = ny / (y_high - y_low)
+    for c in nb.prange(n_chunks):
+        for i in range(c * chunk, min((c + 1) * chunk, n)):
+            xi = x[i]
+            yi = y[i]
+            if xi >= x_low and xi <= x_high and yi >= y_low and yi <= y_high:
+                j = min(int((xi - x_low) * sx), nx - 1)
+                k = min(int((yi - y_low) * sy), ny - 1)
+                counts[c, k, j] += 1
+    return counts.sum(axis=0)
+
+
+def _data_range(x):
+    low, high = float(np.nanmin(x)), float(np.nanmax(x))
+    if low == high:
+        # constant data, widen the range like matplotlib does
+        low, high = low - 0.5, high + 0.5
+    return low, high
+
+
+class _BinnedView:
+    """
+    Draw a histogram from counts that are binned once, instead of
+    handing every event to matplotlib. When the axis limits change
+    only the visible region is binned again, and while the mouse is
+    held down (panning) it is binned at reduced resolution, and binned
+    again at full resolution on release if the limits moved. Subclasses
+    draw the counts with rebin(reduction).
+    """
+
+    pan_reduction = 4
+    delay = 50  # ms to wait for more limit changes before re-binning
+
+    def __init__(self, ax):
+        self.ax = ax
+        self.dragging = False
+        self.moved = False
+        canvas = ax.figure.canvas
+        canvas.mpl_connect("button_press_event", self._on_button_press)
+        canvas.mpl_connect("button_release_event", self._on_button_release)
+        self.timer = canvas.new_timer(interval=self.delay)
+        self.timer.single_shot = True
+        self.timer.add_callback(self._update)
+        ax.callbacks.connect("xlim_changed", self._on_lims)
+        ax.callbacks.connect("ylim_changed", self._on_lims)
+
+    def _on_button_press(self, event):
+        self.dragging = True
+        self.moved = False
+
+    def _on_button_release(self, event):
+        # plain clicks (placing gate vertices) leave the binning alone
+        moved = self.dragging and self.moved
+        self.dragging = False
+        self.moved = False
+        if moved:
+            self._update()
+
+    def _on_lims(self, ax):
+        if self.dragging:
+            self.moved = True
+        self.timer.stop()
+        self.timer.start()
+
+    def _update(self):
+        reduction = self.pan_reduction if self.dragging else 1
+        self.rebin(reduction)
+        self.ax.figure.canvas.draw_idle()
+
+
+class _Hist2DView(_BinnedView):
+    def __init__(
+        self, ax, x, y, bins=10, range=None, cmin=None, cmax=None, **kwargs
+    ):
+        self.ax = ax
+        self.x = x
+        self.y = y
+        self.cmin = cmin
+        self.cmax = cmax
+        # same bins forms as matplotlib hist2d (numpy histogram2d)
+        if np.isscalar(bins):
+            x_bins = y_bins = bins
+        elif len(bins) == 2:
+            x_bins, y_bins = bins
+        else:
+            x_bins = y_bins = bins
+        self.fixed = not (np.isscalar(x_bins) and np.isscalar(y_bins))
+        if self.fixed:
+            # explicit bin edges are kept as they are, nothing to re-bin
+            self._fixed_mesh(ax, x_bins, y_bins, range, **kwargs)
+            _BinnedView.__init__(self, ax)
+            return
+        self.nx, self.ny = x_bins, y_bins
+        if range is None:
+            range = [_data_range(x), _data_range(y)]
+        self.image = ax.imshow(
+            self._counts(range[0], range[1], self.nx, self.ny),
+            extent=(range[0][0], range[0][1], range[1][0], range[1][1]),
+            origin="lower",
+            aspect="auto",
+            interpolation="nearest",
+            **kwargs,
+        )
+        ax.set_xlim(range[0])
+        ax.set_ylim(range[1])
+        # set_extent would otherwise move the limits we are following
+        ax.set_autoscale_on(False)
+        _BinnedView.__init__(self, ax)
+
+    def _fixed_mesh(self, ax, x_bins, y_bins, range, **kwargs):
+        if range is None:
+            range = [_data_range(self.x), _data_range(self.y)]
+        counts, x_edges, y_edges = np.histogram2d(
+            self.x, self.y, bins=[x_bins, y_bins], range=range
+        )
+        counts = self._clip(counts.T)
+        self.image = ax.pcolormesh(x_edges, y_edges, counts, **kwargs)
+        ax.set_xlim(x_edges[0], x_edges[-1])
+        ax.set_ylim(y_edges[0], y_edges[-1])
+
+    def _clip(self, counts):
+        # same convention as matplotlib hist2d
+        if self.cmin is not None:
+            counts[counts < self.cmin] = np.nan
+        if self.cmax is not None:
+            counts[counts > self.cmax] = np.nan
+        return counts
+
+    def _counts(self, xlim, ylim, nx, ny):
+        counts = bin_2d(
+            self.x,
+            self.y,
+            xlim[0],
+            xlim[1],
+            ylim[0],
+            ylim[1],
+            nx,
+            ny,
+            nb.get_num_threads(),
+        ).astype(np.float64)
+        return self._clip(counts)
+
+    def rebin(self, reduction=1):
+        if self.fixed:
+            return
+        xlim = sorted(self.ax.get_xlim())
+        ylim = sorted(self.ax.get_ylim())
+        nx = max(self.nx // reduction, 1)
+        ny = max(self.ny // reduction, 1)
+        self.image.set_data(self._counts(xlim, ylim, nx, ny))
+        self.image.set_extent((xlim[0], xlim[1], ylim[0], ylim[1]))
+
+
+class _Hist1DView(_BinnedView):
+    def __init__(self, ax, x, bins=None, range=None, **kwargs):
+        self.ax = ax
+        self.x = x
+        self.bins = bins if bins is not None else plt.rcParams["hist.bins"]
+        if range is None:
+            range = _data_range(x)
+        if kwargs.pop("histtype", "step") != "step":
+            kwargs.setdefault("fill", True)
+        self.log = kwargs.pop("log", False)
+        # bin edges or a numpy binning rule (e.g. "auto") are kept as
+        # they are, nothing to re-bin
+        self.fixed = not isinstance(self.bins, (int, np.integer))
+        if self.fixed:
+            counts, edges = np.histogram(x, bins=self.bins, range=range)
+            range = (edges[0], edges[-1])
+        else:
+            counts, edges = self._counts(range, self.bins)
+        self.stairs = ax.stairs(counts, edges, **kwargs)
+        ax.set_xlim(range)
+        self._scale_y(counts)
+        _BinnedView.__init__(self, ax)
+
+    def _counts(self, xlim, bins):
+        counts = bin_1d(self.x, xlim[0], xlim[1], bins, nb.get_num_threads())
+        return counts, np.linspace(xlim[0], xlim[1], bins + 1)
+
+    def _scale_y(self, counts):
+        top = max(counts.max(), 1) * 1.05
+        if self.log:
+            self.ax.set_yscale("log")
+            self.ax.set_ylim(0.5, top)
+        else:
+            self.ax.set_ylim(0, top)
+
+    def _on_lims(self, ax):
+        # the y limits follow the counts, only x changes need a re-bin
+        if ax.get_xlim() != getattr(self, "_last_xlim", None):
+            _BinnedView._on_lims(self, ax)
+
+    def rebin(self, reduction=1):
+        if self.fixed:
+            return
+        xlim = sorted(self.ax.get_xlim())
+        self._last_xlim = self.ax.get_xlim()
+        counts, edges = self._counts(xlim, max(self.bins // reduction, 1))
+        self.stairs.set_data(counts, edges)
+        self._scale_y(counts)
+
+
 class Gate1D:
     def __init__(self, col: str, points=None) -> None:
         self.col: str = col
@@ -99,7 +329,7 @@ class CreateGate2D(Gate2D):
         if "cmin" not in hist2d_kwargs:
             hist2d_kwargs["cmin"] = 1
         self.fig, self.ax = plt.subplots()
-        self.ax.hist2d(x, y, **hist2d_kwargs)
+        self.view = _Hist2DView(self.ax, x, y, **hist2d_kwargs)
         self.ax.set_title("Click to set gate, press enter to finish")
         self.cid = plt.connect("button_press_event", self.on_click)
         self.cid2 = plt.connect("key_press_event", self.on_press)
@@ -151,7 +381,9 @@ class Gate2DFromHist2D(Gate2D):
         if "cmin" not in hist2d_kwargs:
             hist2d_kwargs["cmin"] = 1
         self.fig, self.ax = plt.subplots()
-        self.ax.hist2d(x.to_numpy(), y.to_numpy(), **hist2d_kwargs)
+        self.view = _Hist2DView(
+            self.ax, x.to_numpy(), y.to_numpy(), **hist2d_kwargs
+        )
         self.ax.set_title("Click to set gate, press enter to finish")
         self.cid = plt.connect("button_press_event", self.on_click)
         self.cid2 = plt.connect("key_press_event", self.on_press)
@@ -204,7 +436,9 @@ class Gate1DFromHist1D(Gate1D):
             hist1d_kwargs["histtype"] = "step"
         self.hist_kwargs = hist1d_kwargs
         self.fig, self.ax = plt.subplots()
-        self.ax.hist(x.to_numpy(), bins, range, **hist1d_kwargs)
+        self.view = _Hist1DView(
+            self.ax, x.to_numpy(), bins, range, **hist1d_kwargs
+        )
         self.ax.set_title("Click to set gate.")
         self.cid = plt.connect("button_press_event", self.on_click)
         self.lines = []
@@ -0,0 +1,124 @@
+"""
+Time binned monitoring of a Detector over a run. The time column is
+sorted, so the first hit of every time bin is found with a single
+searchsorted and each bin is a contiguous slice of the data. Per bin
+statistics are then a loop over that slice, run in parallel over
+bins. Nothing is proportional to bins times hits, so a full run with
+millions of bins is fine.
+"""
+
+import numpy as np
+import numba as nb
+from numpy.typing import NDArray
+from typing import Any, Optional, Tuple
+
+
+def time_bins(
+    times: NDArray[Any],
+    bin_width: float,
+    start: Optional[float] = None,
+    stop: Optional[float] = None,
+) -> Tuple[NDArray[Any], NDArray[np.int64]]:
+    """Bin edges and the index of the first hit in each bin.
+
+    :param times: sorted time stamps
+    :param bin_width: width of a time bin
+    :param start: first edge, defaults to the first hit
+    :param stop: last edge, defaults to just past the last hit
+    :returns: edges and starts, both of length bins + 1
+    """
+    if bin_width <= 0:
+        raise Exception("bin_width must be positive.")
+    if len(times) == 0 and (start is None or stop is None):
+        return np.zeros(1), np.zeros(1, dtype=np.int64)
+    start = times[0] if start is None else start
+    stop = times[-1] if stop is None else stop
+    n_bins = max(int(np.floor((stop - start) / bin_width)) + 1, 1)
+    steps = np.arange(n_bins + 1) * bin_width
+    if np.issubdtype(times.dtype, np.integer):
+        # t >= start + k * width is the same as t >= start + ceil(k * width)
+        edges = int(np.ceil(start)) + np.ceil(steps).astype(np.int64)
+    else:
+        edges = start + steps
+    starts = np.searchsorted(times, edges, "left").astype(np.int64)
+    return edges, starts
+
+
+@nb.njit(parallel=True, cache=True)
+def bin_moments(
+    starts: NDArray[np.int64], values: NDArray[Any], low: float, high: float
+):
+    """Number of values in [low, high], their mean and standard
+    deviation for each time bin. Empty bins give nan.
+    """
+    n_bins = len(starts) - 1
+    counts = np.zeros(n_bins, dtype=np.int64)
+    mean = np.full(n_bins, np.nan)
+    std = np.full(n_bins, np.nan)
+    for b in nb.prange(n_bins):
+        c = 0
+        total = 0.0
+        for i in range(starts[b], starts[b + 1]):
+            v = values[i]
+            if v >= low and v <= high:
+                c += 1
+                total += v
+        counts[b] = c
+        if c == 0:
+            continue
+        m = total / c
+        sq = 0.0
+        for i in range(starts[b], starts[b + 1]):
+            v = values[i]
+            if v >= low and v <= high:
+                sq += (v - m) ** 2
+        mean[b] = m
+        std[b] = np.sqrt(sq / c)
+    return counts, mean, std
+
+
+@nb.njit(parallel=True, cache=True)
+def bin_time_energy(
+    starts: NDArray[np.int64],
+    values: NDArray[Any],
+    low: float,
+    high: float,
+    bins: int,
+) -> NDArray[np.int64]:
+    """(time bins, bins) histogram of values on [low, high]. Each
+    time bin is its own row, so no per thread copies are needed."""
+    n_bins = len(starts) - 1
+    counts = np.zeros((n_bins, bins), dtype=np.int64)
+    scale = bins / (high - low)
+    for b in nb.prange(n_bins):
+        for i in range(starts[b], starts[b + 1]):
+            v = values[i]
+            if v >= low and v <= high:
+                counts[b, min(int((v - low) * scale), bins - 1)] += 1
+    return counts
+
+
+def intervals_from_bins(
+    edges: NDArray[Any], good: NDArray[np.bool_]
+) -> NDArray[Any]:
+    """Merge runs of good bins into [start, stop) intervals.
+
+    :returns: (intervals, 2) array
+    """
+    step = np.diff(np.concatenate(([0], good.astype(np.int8), [0])))
+    begin = np.flatnonzero(step == 1)
+    end = np.flatnonzero(step == -1)
+    return np.stack((edges[begin], edges[end]), axis=1)
+
+
+def interval_mask(
+    times: NDArray[Any], intervals: NDArray[Any]
+) -> NDArray[np.bool_]:
+    """True for sorted times inside any [start, stop) interval."""
+    intervals = np.asarray(intervals).reshape(-1, 2)
+    first = np.searchsorted(times, intervals[:, 0], "left")
+    last = np.searchsorted(times, intervals[:, 1], "left")
+    inside = np.zeros(len(times) + 1, dtype=np.int64)
+    np.add.at(inside, first, 1)
+    np.add.at(inside, last, -1)
+    return np.cumsum(inside[:-1]) > 0
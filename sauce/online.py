@@ -0,0 +1,320 @@
+"""
+Online analysis of a run that is still being written.
+
+FileFollower reads only the rows added to a csv, feather or parquet
+file (or a directory of rolling sub-run files) since the last read.
+Online feeds those rows to detectors, a ChunkedEventBuilder and a set
+of histograms that are updated in place, so looking at the spectra
+during beam time never re-reads the run from the start.
+
+.. code-block:: python
+
+   online = sauce.Online("run_042.csv", -500, 500, reference="si")
+   online.add_detector("si", module=0, channel=3)
+   online.add_detector("mcp", module=1, channel=0)
+   online.add_hist("si_e", "si", 0, 4000, 4000)
+   online.add_hist("si_e_mcp", ["si", "mcp"], 0, 4000, 4000, col="adc_si")
+   online.run(interval=5.0, callback=my_plot)
+"""
+
+import io
+import os
+import time
+import numpy as np
+import polars as pl
+from numpy.typing import NDArray
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+from .eventbuilder import ChunkedEventBuilder
+from . import config
+
+file_types = (".csv", ".feather", ".parquet")
+
+
+class FileFollower:
+    """
+    Follow a growing run file, or a directory of sub-run files.
+
+    csv files are read from the byte offset of the last complete
+    line. feather and parquet files are rescanned and only the rows
+    after those already seen are collected. If the file is caught
+    in the middle of being written the read is retried on the next call.
+
+    :param path: run file or directory
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = 0
+        self._offset = 0
+        self._header = b""
+        # for directories
+        self._done: List[str] = []
+        self._current: Optional[FileFollower] = None
+
+    def read_new(self) -> Optional[pl.DataFrame]:
+        """Return the rows added since the last call, or None."""
+        if os.path.isdir(self.path):
+            return self._read_directory()
+        if not os.path.exists(self.path):
+            return None
+        if ".csv" in self.path:
+            new = self._read_csv()
+        else:
+            new = self._read_table()
+        if new is not None:
+            self.rows += len(new)
+        return new
+
+    def _read_csv(self) -> Optional[pl.DataFrame]:
+        with open(self.path, "rb") as f:
+            if not self._header:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    return None
+                self._header = line
+                self._offset = len(line)
+            f.seek(self._offset)
+            chunk = f.read()
+        # only complete lines, the writer may be half way through one
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            return None
+        self._offset += end + 1
+        return pl.read_csv(io.BytesIO(self._header + chunk[: end + 1]))
+
+    def _read_table(self) -> Optional[pl.DataFrame]:
+        try:
+            if ".parquet" in self.path:
+                scan = pl.scan_parquet(self.path)
+            else:
+                scan = pl.scan_ipc(self.path, memory_map=False)
+            new = scan.slice(self.rows, None).collect()
+        except Exception:
+            return None
+        return new if len(new) else None
+
+    def _read_directory(self) -> Optional[pl.DataFrame]:
+        files = sorted(
+            os.path.join(self.path, f)
+            for f in os.listdir(self.path)
+            if f.endswith(file_types)
+        )
+        files = [f for f in files if f not in self._done]
+        frames = []
+        for f in files:
+            if self._current is None or self._current.path != f:
+                self._current = FileFollower(f)
+            new = self._current.read_new()
+            if new is not None:
+                frames.append(new)
+            # every file except the newest one is finished
+            if f != files[-1]:
+                self._done.append(f)
+        if not frames:
+            return None
+        new = pl.concat(frames, how="vertical_relaxed")
+        self.rows += len(new)
+        return new
+
+
+class OnlineHistogram:
+    """
+    Fixed binning histogram that is filled as data arrive.
+
+    :param lower: lower edge
+    :param upper: upper edge
+    :param bins: number of bins
+    :param col: column to histogram
+    """
+
+    def __init__(self, lower: float, upper: float, bins: int, col: str):
+        self.lower = lower
+        self.upper = upper
+        self.bins = bins
+        self.col = col
+        self.edges = np.linspace(lower, upper, bins + 1)
+        self.counts = np.zeros(bins)
+
+    def fill(self, data: pl.DataFrame):
+        if len(data) == 0:
+            return
+        counts, _ = np.histogram(data[self.col].to_numpy(), bins=self.edges)
+        self.counts += counts
+
+    def reset(self):
+        self.counts[:] = 0
+
+    def hist(self, centers: bool = True):
+        """Same return values as Detector.hist."""
+        if centers:
+            return self.edges[:-1], self.counts
+        return self.counts, self.edges
+
+
+class Online:
+    """
+    Incrementally updated event building and spectra for a run that
+    is still being written.
+
+    :param path: run file or directory of sub-run files
+    :param low: lower bound of the build window
+    :param high: upper bound of the build window
+    :param reference: name of the detector whose hits open build windows
+    :param lag: how far out of time order the file can be
+    :param scaler_path: optional scaler file to follow
+    """
+
+    def __init__(
+        self,
+        path: str,
+        low: float,
+        high: float,
+        reference: Optional[str] = None,
+        lag: float = 0.0,
+        scaler_path: Optional[str] = None,
+    ):
+        self.follower = FileFollower(path)
+        self.low = low
+        self.high = high
+        self.lag = lag
+        self.reference = reference
+        self.selections: Dict[str, Dict[str, Any]] = {}
+        self.hists: Dict[str, OnlineHistogram] = {}
+        self._hist_dets: Dict[str, List[str]] = {}
+        self.eb: Optional[ChunkedEventBuilder] = None
+        self.scalers = FileFollower(scaler_path) if scaler_path else None
+        self.scaler_sums: Optional[NDArray[Any]] = None
+        self.scaler_rates: Optional[NDArray[Any]] = None
+        self._last_update = time.time()
+
+    def add_detector(self, name: str, **kwargs):
+        """Define a detector by the same column constraints
+        used in Detector.find_hits."""
+        self.selections[name] = kwargs
+        return self
+
+    def add_hist(
+        self,
+        hist_name: str,
+        dets: Union[str, Sequence[str]],
+        lower: float,
+        upper: float,
+        bins: int,
+        col: Optional[str] = None,
+    ):
+        """Add a histogram. A single detector name gives a singles
+        spectrum. A list of names gives a coincidence spectrum,
+        where columns are named like Coincident output (adc_si, ...).
+        """
+        if isinstance(dets, str):
+            dets = [dets]
+        if col is None:
+            col = config.default_energy_col
+            if len(dets) > 1:
+                col += "_" + dets[0]
+        self.hists[hist_name] = OnlineHistogram(lower, upper, bins, col)
+        self._hist_dets[hist_name] = list(dets)
+        return self
+
+    def _select(self, data: pl.DataFrame, name: str) -> pl.DataFrame:
+        kwargs = self.selections[name]
+        return data.filter(**kwargs).drop(list(kwargs))
+
+    def update(self, final: bool = False) -> int:
+        """Read new data and update every histogram.
+
+        :param final: close all open build windows (the run has ended)
+        :returns: number of new rows
+        """
+        new = self.follower.read_new()
+        self._update_scalers()
+        if new is None and not final:
+            return 0
+        if new is None:
+            new = pl.DataFrame()
+        time_col = config.default_time_col
+        dets = {
+            name: (
+                self._select(new, name).sort(time_col)
+                if len(new)
+                else pl.DataFrame()
+            )
+            for name in self.selections
+        }
+        for name, h in self.hists.items():
+            if len(self._hist_dets[name]) == 1:
+                h.fill(dets[self._hist_dets[name][0]])
+
+        if any(len(d) > 1 for d in self._hist_dets.values()):
+            self._update_coincidences(dets, final)
+        return len(new)
+
+    def _update_coincidences(self, dets, final):
+        time_col = config.default_time_col
+        if self.eb is None:
+            self.eb = ChunkedEventBuilder(
+                self.low, self.high, lag=self.lag, col=time_col
+            )
+        ref_name = self.reference or list(self.selections)[0]
+        ref = dets[ref_name]
+        ref_times = ref[time_col] if len(ref) else np.empty(0)
+        assigned = self.eb.push(
+            ref_times, {k: v for k, v in dets.items() if len(v)}, final
+        )
+        for name, h in self.hists.items():
+            names = self._hist_dets[name]
+            if len(names) == 1 or any(n not in assigned for n in names):
+                continue
+            frames = [
+                assigned[n].rename(
+                    {
+                        c: c + "_" + n
+                        for c in assigned[n].columns
+                        if c != "event"
+                    }
+                )
+                for n in names
+            ]
+            coin = frames[0]
+            for f in frames[1:]:
+                coin = coin.join(f, on="event", how="inner")
+            h.fill(coin)
+
+    def _update_scalers(self):
+        if self.scalers is None:
+            return
+        now = time.time()
+        new = self.scalers.read_new()
+        elapsed = now - self._last_update
+        self._last_update = now
+        if new is None:
+            return
+        sums = new.sum().to_numpy()[0]
+        self.scaler_sums = (
+            sums if self.scaler_sums is None else self.scaler_sums + sums
+        )
+        self.scaler_rates = sums / elapsed if elapsed > 0 else None
+
+    def run(
+        self,
+        interval: float = 2.0,
+        callback: Optional[Callable[["Online"], Any]] = None,
+        timeout: Optional[float] = None,
+    ):
+        """Poll the run file until interrupted (or timeout seconds
+        without new data), calling callback(self) after each update
+        that found new rows.
+        """
+        idle = 0.0
+        try:
+            while timeout is None or idle < timeout:
+                if self.update():
+                    idle = 0.0
+                    if callback is not None:
+                        callback(self)
+                else:
+                    idle += interval
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        return self
@@ -0,0 +1,147 @@
+"""
+Per event reductions. Event numbers from build_referenceless_events
+and the event builders are non-decreasing, so the hits of an event
+are already next to each other. Instead of a group_by (which hashes
+every hit), the event boundaries are found once and each event is
+reduced by a short loop. Events are independent, so the loops run in
+parallel over event ranges.
+"""
+
+import numpy as np
+import numba as nb
+from numpy.typing import NDArray
+from typing import Any
+
+
+def event_starts(events: NDArray[Any]) -> NDArray[np.int64]:
+    """Index of the first hit of every event, followed by the
+    total number of hits.
+
+    :param events: non-decreasing event numbers
+    :returns: array of length number of events + 1
+    """
+    if len(events) == 0:
+        return np.zeros(1, dtype=np.int64)
+    if np.any(events[1:] < events[:-1]):
+        raise Exception(
+            "Event numbers are not sorted, the hits of an event must be contiguous."
+        )
+    change = np.flatnonzero(events[1:] != events[:-1]) + 1
+    return np.concatenate(([0], change, [len(events)])).astype(np.int64)
+
+
+@nb.njit(parallel=True, cache=True)
+def event_sum(starts: NDArray[np.int64], values: NDArray[Any]) -> NDArray[Any]:
+    """Sum of values over each event."""
+    n_events = len(starts) - 1
+    sums = np.zeros(n_events, dtype=values.dtype)
+    for e in nb.prange(n_events):
+        total = values[starts[e]]
+        for i in range(starts[e] + 1, starts[e + 1]):
+            total += values[i]
+        sums[e] = total
+    return sums
+
+
+@nb.njit(parallel=True, cache=True)
+def event_argmax(
+    starts: NDArray[np.int64], values: NDArray[Any]
+) -> NDArray[np.int64]:
+    """Index of the hit with the largest value in each event.
+    Ties go to the first hit."""
+    n_events = len(starts) - 1
+    index = np.empty(n_events, dtype=np.int64)
+    for e in nb.prange(n_events):
+        best = starts[e]
+        for i in range(starts[e] + 1, starts[e + 1]):
+            if values[i] > values[best]:
+                best = i
+        index[e] = best
+    return index
+
+
+@nb.njit(parallel=True, cache=True)
+def event_bitmask(
+    starts: NDArray[np.int64], strips: NDArray[np.int64]
+) -> NDArray[np.uint64]:
+    """Bit i is set if strip i was hit in the event. Strips
+    outside 0-63 are ignored."""
+    n_events = len(starts) - 1
+    masks = np.zeros(n_events, dtype=np.uint64)
+    for e in nb.prange(n_events):
+        mask = np.uint64(0)
+        for i in range(starts[e], starts[e + 1]):
+            s = strips[i]
+            if 0 <= s < 64:
+                mask |= np.uint64(1) << np.uint64(s)
+        masks[e] = mask
+    return masks
+
+
+@nb.njit(parallel=True, cache=True)
+def _cluster_counts(
+    starts: NDArray[np.int64], strips: NDArray[np.int64], gap: int
+) -> NDArray[np.int64]:
+    n_events = len(starts) - 1
+    counts = np.zeros(n_events, dtype=np.int64)
+    for e in nb.prange(n_events):
+        s = np.sort(strips[starts[e] : starts[e + 1]])
+        c = 1
+        for k in range(1, len(s)):
+            if s[k] - s[k - 1] > gap:
+                c += 1
+        counts[e] = c
+    return counts
+
+
+@nb.njit(parallel=True, cache=True)
+def _cluster_fill(
+    starts: NDArray[np.int64],
+    strips: NDArray[np.int64],
+    energy: NDArray[Any],
+    gap: int,
+    offsets: NDArray[np.int64],
+):
+    n_events = len(starts) - 1
+    keep = np.empty(offsets[-1], dtype=np.int64)
+    summed = np.empty(offsets[-1], dtype=energy.dtype)
+    for e in nb.prange(n_events):
+        lo = starts[e]
+        order = np.argsort(strips[lo : starts[e + 1]], kind="mergesort") + lo
+        c = offsets[e]
+        keep[c] = order[0]
+        summed[c] = energy[order[0]]
+        for k in range(1, len(order)):
+            i = order[k]
+            if strips[i] - strips[order[k - 1]] > gap:
+                c += 1
+                keep[c] = i
+                summed[c] = energy[i]
+            else:
+                summed[c] += energy[i]
+                if energy[i] > energy[keep[c]]:
+                    keep[c] = i
+    return keep, summed
+
+
+def event_addback(
+    starts: NDArray[np.int64],
+    strips: NDArray[np.int64],
+    energy: NDArray[Any],
+    gap: int = 1,
+):
+    """Group the hits of each event into clusters of neighbouring
+    strips (strip numbers at most gap apart) and sum their energies.
+
+    :param starts: from event_starts
+    :param strips: strip (or crystal) number of each hit
+    :param energy: energy of each hit
+    :param gap: largest strip difference inside a cluster
+    :returns: index of the highest energy hit of each cluster, cluster energies
+    """
+    if len(starts) < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=energy.dtype)
+    counts = _cluster_counts(starts, strips, gap)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return _cluster_fill(starts, strips, energy, gap, offsets)
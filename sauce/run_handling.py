@@ -1,24 +1,195 @@
 import polars as pl
+import threading
+from collections import deque
 from . import config
-from typing import Optional
+from typing import Any, Callable, Iterator, Optional, Sequence, Tuple
 
 
 class Run:
-
     """
     This loads in an entire run to memory to improve the
     speed at which Detector objects can be created. It also
     sorts the run by time stamps
+
+    Pass columns to only read the columns that are needed.
     """
 
-    def __init__(self, filename, primary_time_col: Optional[str] = None):
+    def __init__(
+        self,
+        filename,
+        primary_time_col: Optional[str] = None,
+        columns: Optional[Sequence[str]] = None,
+    ):
         self.filename = filename
+        if columns is not None:
+            columns = list(columns)
         if ".csv" in filename:
-            self.data = pl.read_csv(filename)
+            self.data = pl.read_csv(filename, columns=columns)
         if ".parquet" in filename:
-            self.data = pl.read_parquet(filename)
+            self.data = pl.read_parquet(filename, columns=columns)
         if ".feather" in filename:
-            self.data = pl.read_ipc(filename)
+            self.data = pl.read_ipc(filename, columns=columns)
         if not primary_time_col:
             primary_time_col = config.default_time_col
         self.data = self.data.sort(by=primary_time_col)
+
+
+def iter_run_chunks(
+    filename: str, chunk_size: int = 1_000_000
+) -> Iterator[pl.DataFrame]:
+    """
+    Read a run file in pieces of about chunk_size rows, in file order,
+    without loading the whole file. Nothing is sorted, so for
+    event building the file needs to be written in time order.
+
+    :param filename: csv, parquet or feather file
+    :param chunk_size: rows per chunk
+    """
+    if ".csv" in filename:
+        reader = pl.read_csv_batched(filename, batch_size=chunk_size)
+        while True:
+            batches = reader.next_batches(1)
+            if not batches:
+                return
+            yield batches[0]
+    if ".parquet" in filename:
+        scan = pl.scan_parquet(filename)
+    elif ".feather" in filename:
+        scan = pl.scan_ipc(filename)
+    else:
+        raise (FileNotFoundError)
+    offset = 0
+    while True:
+        chunk = scan.slice(offset, chunk_size).collect()
+        if len(chunk) == 0:
+            return
+        yield chunk
+        offset += len(chunk)
+
+
+def _loaded_size(obj: Any) -> int:
+    """Rough in memory size of whatever a prefetch loader returned."""
+    if isinstance(obj, pl.DataFrame):
+        return int(obj.estimated_size())
+    if isinstance(getattr(obj, "data", None), pl.DataFrame):
+        return int(obj.data.estimated_size())
+    if isinstance(obj, dict):
+        obj = list(obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(_loaded_size(o) for o in obj)
+    return 0
+
+
+class RunPrefetcher:
+    """
+    Iterate over runs while the next ones are loaded in a background
+    thread, so reading from disk overlaps with the analysis of the
+    current run. polars releases the GIL while it reads and decodes,
+    so a thread is enough.
+
+    .. code-block:: python
+
+       for filename, run in sauce.RunPrefetcher(files, depth=2):
+           si = sauce.Detector("si").find_hits(run, module=0, channel=3)
+           ...
+
+    load can be any function of the filename, for example one that
+    calls find_hits for a few detectors or reads the scalers. If load
+    raises, the exception is raised by the iterator at that run.
+
+    :param files: run filenames, in the order they are analysed
+    :param load: function filename -> data, defaults to Run(filename, columns=columns)
+    :param depth: how many runs are loaded ahead of the current one
+    :param max_memory: do not start loading another run while the runs
+        waiting to be analysed take more than this many bytes
+    :param columns: columns read by the default loader
+    """
+
+    def __init__(
+        self,
+        files: Sequence[str],
+        load: Optional[Callable[[str], Any]] = None,
+        depth: int = 1,
+        max_memory: Optional[float] = None,
+        columns: Optional[Sequence[str]] = None,
+    ):
+        if depth < 1:
+            raise ValueError("depth must be at least 1.")
+        self.files = list(files)
+        self.load = (
+            load if load is not None else lambda f: Run(f, columns=columns)
+        )
+        self.depth = depth
+        self.max_memory = max_memory
+        self._queue: deque = deque()
+        self._bytes = 0
+        self._done = False
+        self._stop = False
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def _full(self) -> bool:
+        if len(self._queue) >= self.depth:
+            return True
+        # the memory cap never blocks the next run if nothing is waiting
+        return (
+            self.max_memory is not None
+            and len(self._queue) > 0
+            and self._bytes >= self.max_memory
+        )
+
+    def _work(self):
+        for filename in self.files:
+            with self._cond:
+                while self._full() and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    break
+            try:
+                item = (filename, self.load(filename), None)
+            except Exception as e:
+                item = (filename, None, e)
+            size = _loaded_size(item[1])
+            with self._cond:
+                self._queue.append((item, size))
+                self._bytes += size
+                self._cond.notify_all()
+        with self._cond:
+            self._done = True
+            self._cond.notify_all()
+
+    def __iter__(self) -> "RunPrefetcher":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work, daemon=True)
+            self._thread.start()
+        return self
+
+    def __next__(self) -> Tuple[str, Any]:
+        self.__iter__()
+        with self._cond:
+            while not self._queue and not self._done:
+                self._cond.wait()
+            if not self._queue:
+                raise StopIteration
+            (filename, data, error), size = self._queue.popleft()
+            self._bytes -= size
+            self._cond.notify_all()
+        if error is not None:
+            raise error
+        return filename, data
+
+    def close(self):
+        """Stop loading runs and drop the ones already loaded."""
+        with self._cond:
+            self._stop = True
+            self._queue.clear()
+            self._bytes = 0
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "RunPrefetcher":
+        return self.__iter__()
+
+    def __exit__(self, *args):
+        self.close()
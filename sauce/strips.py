@@ -0,0 +1,202 @@
+"""
+Front/back strip matching for double sided silicon strip detectors.
+
+The front and back strips are separate Detectors whose hits have been
+grouped with build_referenceless_events. Events of the two sides are
+paired by their first time stamps with a two pointer sweep, and inside
+each pair of events front and back hits are matched one to one,
+smallest energy difference first, as long as the energies agree within
+the tolerance. Nothing is joined, so high multiplicity events cost
+front multiplicity times back multiplicity instead of growing the
+whole frame.
+
+.. code-block:: python
+
+   front.build_referenceless_events(500.0)
+   back.build_referenceless_events(500.0)
+   pixels = sauce.match_strips(front, back, "strip", "strip", 500.0, 50.0)
+"""
+
+import numpy as np
+import numba as nb
+import polars as pl
+from numpy.typing import NDArray
+from typing import Any, Optional, Tuple
+from .detectors import Detector, tick_times, tick_window
+from .reductions import event_starts
+
+
+@nb.njit
+def pair_events(
+    t_front: NDArray[Any], t_back: NDArray[Any], window: float
+) -> Tuple[NDArray[np.int64], NDArray[np.int64]]:
+    """Pair front and back events whose times differ by at most window.
+    Both arrays are sorted, each event is used at most once.
+
+    :returns: front event index, back event index
+    """
+    n_f = len(t_front)
+    n_b = len(t_back)
+    front = np.empty(min(n_f, n_b), dtype=np.int64)
+    back = np.empty(min(n_f, n_b), dtype=np.int64)
+    i = 0
+    j = 0
+    k = 0
+    while i < n_f and j < n_b:
+        dt = t_back[j] - t_front[i]
+        if dt < -window:
+            j += 1
+        elif dt > window:
+            i += 1
+        else:
+            front[k] = i
+            back[k] = j
+            k += 1
+            i += 1
+            j += 1
+    return front[:k], back[:k]
+
+
+@nb.njit(parallel=True, cache=True)
+def match_events(
+    f_starts: NDArray[np.int64],
+    b_starts: NDArray[np.int64],
+    f_events: NDArray[np.int64],
+    b_events: NDArray[np.int64],
+    e_front: NDArray[np.float64],
+    e_back: NDArray[np.float64],
+    tolerance: float,
+    rel_tolerance: float,
+):
+    """One to one matching of front and back hits in each pair of
+    events. Pairs with the smallest energy difference are taken first.
+
+    :returns: front hit index, back hit index and a mask of filled slots
+    """
+    n_pairs = len(f_events)
+    offsets = np.zeros(n_pairs + 1, dtype=np.int64)
+    for p in range(n_pairs):
+        n_f = f_starts[f_events[p] + 1] - f_starts[f_events[p]]
+        n_b = b_starts[b_events[p] + 1] - b_starts[b_events[p]]
+        offsets[p + 1] = offsets[p] + min(n_f, n_b)
+    front = np.empty(offsets[-1], dtype=np.int64)
+    back = np.empty(offsets[-1], dtype=np.int64)
+    filled = np.zeros(offsets[-1], dtype=np.bool_)
+    for p in nb.prange(n_pairs):
+        f_lo = f_starts[f_events[p]]
+        n_f = f_starts[f_events[p] + 1] - f_lo
+        b_lo = b_starts[b_events[p]]
+        n_b = b_starts[b_events[p] + 1] - b_lo
+        # every allowed front/back combination in the event
+        diffs = np.empty(n_f * n_b)
+        cand_f = np.empty(n_f * n_b, dtype=np.int64)
+        cand_b = np.empty(n_f * n_b, dtype=np.int64)
+        n_cand = 0
+        for a in range(n_f):
+            ea = e_front[f_lo + a]
+            for b in range(n_b):
+                eb = e_back[b_lo + b]
+                d = abs(ea - eb)
+                if d <= tolerance + rel_tolerance * 0.5 * (ea + eb):
+                    diffs[n_cand] = d
+                    cand_f[n_cand] = a
+                    cand_b[n_cand] = b
+                    n_cand += 1
+        order = np.argsort(diffs[:n_cand], kind="mergesort")
+        used_f = np.zeros(n_f, dtype=np.bool_)
+        used_b = np.zeros(n_b, dtype=np.bool_)
+        k = offsets[p]
+        for o in order:
+            a = cand_f[o]
+            b = cand_b[o]
+            if used_f[a] or used_b[b]:
+                continue
+            used_f[a] = True
+            used_b[b] = True
+            front[k] = f_lo + a
+            back[k] = b_lo + b
+            filled[k] = True
+            k += 1
+    return front, back, filled
+
+
+def match_strips(
+    front: Detector,
+    back: Detector,
+    x_col: str,
+    y_col: str,
+    window: float,
+    tolerance: float,
+    rel_tolerance: float = 0.0,
+    energy: str = "front",
+    name: Optional[str] = None,
+) -> Detector:
+    """Match front and back strip hits into pixel hits.
+
+    Both detectors need event numbers from build_referenceless_events.
+    A front and a back event belong together if their first hits are
+    at most window apart. Hits are matched if
+    abs(E_front - E_back) <= tolerance + rel_tolerance * mean energy.
+
+    :param front: front strips (x)
+    :param back: back strips (y)
+    :param x_col: strip number column of front
+    :param y_col: strip number column of back
+    :param window: largest time difference between front and back events
+    :param tolerance: allowed energy difference
+    :param rel_tolerance: allowed energy difference as a fraction of the energy
+    :param energy: energy of the pixel, "front", "back" or "mean"
+    :param name: name of the new detector, defaults to front_back
+    :returns: Detector with strip_x, strip_y, energy, time and event columns
+    """
+    if energy not in ("front", "back", "mean"):
+        raise ValueError('energy must be "front", "back" or "mean".')
+    f_starts = front._event_starts(None)
+    b_starts = back._event_starts(None)
+    f_times = tick_times(front[front.primary_time_col].to_numpy())
+    b_times = tick_times(back[back.primary_time_col].to_numpy())
+    t_f = f_times[f_starts[:-1]]
+    t_b = b_times[b_starts[:-1]]
+    if t_f.dtype != t_b.dtype:
+        t_f = t_f.astype(np.float64)
+        t_b = t_b.astype(np.float64)
+    window = tick_window(t_f, -window, window)[1]
+    f_events, b_events = pair_events(t_f, t_b, window)
+
+    e_front = front[front.primary_energy_col].to_numpy().astype(np.float64)
+    e_back = back[back.primary_energy_col].to_numpy().astype(np.float64)
+    f_hits, b_hits, filled = match_events(
+        f_starts,
+        b_starts,
+        f_events,
+        b_events,
+        e_front,
+        e_back,
+        tolerance,
+        rel_tolerance,
+    )
+    f_hits = f_hits[filled]
+    b_hits = b_hits[filled]
+    if energy == "front":
+        pixel_energy = e_front[f_hits]
+    elif energy == "back":
+        pixel_energy = e_back[b_hits]
+    else:
+        pixel_energy = 0.5 * (e_front[f_hits] + e_back[b_hits])
+
+    pixels = Detector(
+        name if name else front.name + "_" + back.name,
+        primary_energy_col="energy",
+        primary_time_col="time",
+    )
+    pixels.data = pl.DataFrame(
+        {
+            "strip_x": front[x_col].to_numpy()[f_hits],
+            "strip_y": back[y_col].to_numpy()[b_hits],
+            "energy": pixel_energy,
+            "time": front[front.primary_time_col].to_numpy()[f_hits],
+            "event": front[front._event_col(None)].to_numpy()[f_hits],
+        }
+    )
+    pixels.livetime = min(front.livetime, back.livetime)
+    return pixels
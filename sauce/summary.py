@@ -0,0 +1,383 @@
+"""
+Compact per run summaries stored next to the run file.
+
+A summary holds, for every channel, the number of hits, the first
+and last time stamp, the range of every other numeric column and a
+coarse rate histogram. It is computed once with a lazy scan and
+written to <run file>.summary.json. After that, questions like "which
+runs have hits in module 2 channel 5" or "how long is this run" are
+answered from the sidecar without reading the raw data.
+
+Detector.find_hits checks for a sidecar and skips the file when the
+requested channel has no hits, and run_batch can select runs by their
+summary:
+
+.. code-block:: python
+
+   summaries = [sauce.summarize_run(f) for f in files]
+   good = sauce.select_runs(files, module=2, channel=5, min_counts=1000)
+   results = sauce.run_batch(good, analysis)
+"""
+
+import os
+import json
+import numpy as np
+import polars as pl
+from numpy.typing import NDArray
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+from . import config
+
+summary_extension = ".summary.json"
+
+
+def summary_file(filename: str) -> str:
+    """Path of the summary sidecar for a run file."""
+    return filename + summary_extension
+
+
+def _source_identity(filename: str) -> list:
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _scan(filename: str) -> pl.LazyFrame:
+    if ".csv" in filename:
+        return pl.scan_csv(filename)
+    elif ".parquet" in filename:
+        return pl.scan_parquet(filename)
+    elif ".feather" in filename:
+        return pl.scan_ipc(filename)
+    raise (FileNotFoundError)
+
+
+class RunSummary:
+    """
+    Summary of a single run file.
+
+    :param filename: the run file that was summarized
+    :param channels: one row per channel with the key columns, rows,
+        time_min, time_max and <col>_min, <col>_max for the other
+        numeric columns
+    :param rate: (channels, rate bins) hit counts
+    :param rate_edges: time edges of the rate bins
+    :param keys: columns that identify a channel
+    :param time_col: time column
+    :param source: size and modification time of the run file
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        channels: pl.DataFrame,
+        rate: NDArray[np.int64],
+        rate_edges: NDArray[Any],
+        keys: Sequence[str],
+        time_col: str,
+        source: Optional[list] = None,
+    ):
+        self.filename = filename
+        self.channels = channels
+        self.rate = rate
+        self.rate_edges = rate_edges
+        self.keys = list(keys)
+        self.time_col = time_col
+        self.source = source
+
+    @classmethod
+    def compute(
+        cls,
+        filename: str,
+        keys: Sequence[str] = ("crate", "module", "channel"),
+        time_col: Optional[str] = None,
+        rate_bins: int = 100,
+    ) -> "RunSummary":
+        """Summarize a run file with a lazy scan.
+
+        :param filename: csv, parquet or feather run file
+        :param keys: columns that identify a channel
+        :param time_col: defaults to config.default_time_col
+        :param rate_bins: number of bins in the rate histograms
+        :returns: RunSummary
+        """
+        time_col = time_col if time_col else config.default_time_col
+        source = _source_identity(filename)
+        scan = _scan(filename)
+        schema = scan.limit(0).collect().schema
+        keys = [k for k in keys if k in schema]
+        values = [
+            c
+            for c in schema
+            if c not in keys and c != time_col and schema[c].is_numeric()
+        ]
+        aggs = [
+            pl.col(time_col).count().alias("rows"),
+            pl.col(time_col).min().alias("time_min"),
+            pl.col(time_col).max().alias("time_max"),
+        ]
+        for c in values:
+            aggs += [
+                pl.col(c).min().alias(c + "_min"),
+                pl.col(c).max().alias(c + "_max"),
+            ]
+        if keys:
+            channels = scan.group_by(keys).agg(aggs).sort(keys).collect()
+        else:
+            channels = scan.select(aggs).collect()
+
+        if len(channels) == 0 or channels["rows"].sum() == 0:
+            return cls(
+                filename,
+                channels,
+                np.zeros((len(channels), rate_bins), dtype=np.int64),
+                np.zeros(rate_bins + 1),
+                keys,
+                time_col,
+                source,
+            )
+        t_min = channels["time_min"].min()
+        t_max = channels["time_max"].max()
+        span = max(float(t_max) - float(t_min), 1.0)
+        rate_bin = (
+            (
+                (pl.col(time_col).cast(pl.Float64) - float(t_min))
+                * (rate_bins / span)
+            )
+            .floor()
+            .cast(pl.Int64)
+            .clip(0, rate_bins - 1)
+            .alias("_rate_bin")
+        )
+        binned = (
+            scan.group_by(keys + [rate_bin])
+            .agg(pl.col(time_col).count().alias("_n"))
+            .collect()
+        )
+        if keys:
+            index = channels.select(keys).with_columns(
+                pl.Series("_index", np.arange(len(channels)))
+            )
+            binned = binned.join(index, on=keys, how="inner")
+        else:
+            binned = binned.with_columns(pl.lit(0).alias("_index"))
+        rate = np.zeros((len(channels), rate_bins), dtype=np.int64)
+        np.add.at(
+            rate,
+            (binned["_index"].to_numpy(), binned["_rate_bin"].to_numpy()),
+            binned["_n"].to_numpy(),
+        )
+        rate_edges = float(t_min) + np.linspace(0.0, span, rate_bins + 1)
+        return cls(
+            filename, channels, rate, rate_edges, keys, time_col, source
+        )
+
+    def save(self, filename: Optional[str] = None) -> None:
+        """Write the summary as json, by default next to the run file."""
+        path = filename if filename else summary_file(self.filename)
+        meta = {
+            "filename": self.filename,
+            "source": self.source,
+            "keys": self.keys,
+            "time_col": self.time_col,
+            "channels": self.channels.to_dict(as_series=False),
+            "rate": self.rate.tolist(),
+            "rate_edges": self.rate_edges.tolist(),
+        }
+        with open(path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, filename: str) -> "RunSummary":
+        """Read a summary sidecar.
+
+        :param filename: the run file (or the sidecar itself)
+        :returns: RunSummary
+        """
+        path = (
+            filename
+            if filename.endswith(summary_extension)
+            else summary_file(filename)
+        )
+        with open(path, "r") as f:
+            meta = json.load(f)
+        rate_edges = np.array(meta["rate_edges"])
+        # json keeps no types, columns of a run without hits come back
+        # as Null and cannot be summed
+        channels = pl.DataFrame(meta["channels"]).with_columns(
+            pl.col(pl.Null).cast(pl.Int64)
+        )
+        return cls(
+            meta["filename"],
+            channels,
+            # explicit shape, a run without hits has no rate rows
+            np.array(meta["rate"], dtype=np.int64).reshape(
+                len(meta["channels"]["rows"]), len(rate_edges) - 1
+            ),
+            rate_edges,
+            meta["keys"],
+            meta["time_col"],
+            meta["source"],
+        )
+
+    def is_current(self) -> bool:
+        """True if the run file has not changed since it was summarized."""
+        if not os.path.exists(self.filename):
+            return False
+        return self.source == _source_identity(self.filename)
+
+    def _mask(self, **constraints) -> NDArray[np.bool_]:
+        mask = np.ones(len(self.channels), dtype=bool)
+        for k, v in constraints.items():
+            if k not in self.channels.columns:
+                raise KeyError(
+                    "{} is not a key column of the summary.".format(k)
+                )
+            mask &= self.channels[k].to_numpy() == v
+        return mask
+
+    def select(self, **constraints) -> pl.DataFrame:
+        """Channels matching constraints given as column=value, the
+        same way as in Detector.find_hits."""
+        return self.channels.filter(pl.Series(self._mask(**constraints)))
+
+    def counts(self, **constraints) -> int:
+        """Number of hits in the matching channels."""
+        return int(self.select(**constraints)["rows"].sum())
+
+    def has_hits(self, **constraints) -> bool:
+        return self.counts(**constraints) > 0
+
+    def time_range(self, **constraints) -> Tuple[Any, Any]:
+        """First and last time stamp of the matching channels."""
+        selected = self.select(**constraints)
+        return selected["time_min"].min(), selected["time_max"].max()
+
+    def value_range(self, col: str, **constraints) -> Tuple[Any, Any]:
+        """Smallest and largest value of col in the matching channels,
+        useful to pick histogram limits."""
+        selected = self.select(**constraints)
+        return selected[col + "_min"].min(), selected[col + "_max"].max()
+
+    @property
+    def duration(self) -> float:
+        start, stop = self.time_range()
+        if start is None:
+            return 0.0
+        return float(stop) - float(start)
+
+    def rate_hist(self, **constraints) -> Tuple[NDArray[Any], NDArray[Any]]:
+        """Coarse hit rate histogram of the matching channels.
+        The return values follow Detector.hist with centers=True."""
+        return self.rate_edges[:-1], self.rate[self._mask(**constraints)].sum(
+            axis=0
+        )
+
+    def mean_rate(self, **constraints) -> float:
+        """Hits per time unit of the matching channels."""
+        duration = self.duration
+        return self.counts(**constraints) / duration if duration else 0.0
+
+    def random_coincidences(
+        self,
+        window: float,
+        first: Dict[str, Any],
+        second: Dict[str, Any],
+    ) -> float:
+        """Expected number of random coincidences between two sets of
+        channels for a build window of the given width. Compare with the
+        expected true coincidences when choosing a build window.
+
+        :param window: width of the build window (high - low)
+        :param first: constraints of the first detector
+        :param second: constraints of the second detector
+        """
+        return (
+            self.mean_rate(**first)
+            * self.mean_rate(**second)
+            * window
+            * self.duration
+        )
+
+
+def summarize_run(
+    filename: str,
+    keys: Sequence[str] = ("crate", "module", "channel"),
+    time_col: Optional[str] = None,
+    rate_bins: int = 100,
+    overwrite: bool = False,
+) -> RunSummary:
+    """Return the summary of a run file. The sidecar is reused if the
+    run file has not changed, otherwise the run is scanned and a new
+    sidecar is written.
+
+    :param filename: run file
+    :param keys: columns that identify a channel
+    :param time_col: defaults to config.default_time_col
+    :param rate_bins: number of bins in the rate histograms
+    :param overwrite: always recompute
+    :returns: RunSummary
+    """
+    summary = None if overwrite else cached_summary(filename)
+    if summary is None:
+        summary = RunSummary.compute(filename, keys, time_col, rate_bins)
+        summary.save()
+    return summary
+
+
+def cached_summary(filename: str) -> Optional[RunSummary]:
+    """The sidecar summary of filename if one exists and is up to
+    date, otherwise None. Never reads the run file itself."""
+    path = summary_file(filename)
+    if not os.path.exists(path):
+        return None
+    try:
+        summary = RunSummary.load(path)
+    except (ValueError, KeyError, OSError):
+        return None
+    # the run directory may have been moved since
+    summary.filename = filename
+    return summary if summary.is_current() else None
+
+
+def campaign_summary(files: Sequence[str], **kwargs) -> pl.DataFrame:
+    """One row per run and channel for a whole campaign, built from
+    the sidecars (runs without one are summarized first).
+
+    :param files: run files
+    :param kwargs: passed to summarize_run
+    :returns: DataFrame with a run column added to RunSummary.channels
+    """
+    frames = [
+        summarize_run(f, **kwargs).channels.with_columns(
+            pl.lit(f).alias("run")
+        )
+        for f in files
+    ]
+    if not frames:
+        return pl.DataFrame()
+    return pl.concat(frames, how="diagonal_relaxed")
+
+
+def select_runs(
+    files: Sequence[str],
+    predicate: Optional[Callable[[RunSummary], bool]] = None,
+    min_counts: int = 1,
+    **constraints,
+) -> list:
+    """Runs with at least min_counts hits in the channels matching
+    constraints, and for which predicate(summary) is True.
+
+    :param files: run files
+    :param predicate: optional test on the RunSummary
+    :param min_counts: fewest hits in the matching channels
+    :returns: list of the selected files, in order
+    """
+    selected = []
+    for f in files:
+        summary = summarize_run(f)
+        if summary.counts(**constraints) < min_counts:
+            continue
+        if predicate is not None and not predicate(summary):
+            continue
+        selected.append(f)
+    return selected
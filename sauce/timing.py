@@ -0,0 +1,301 @@
+"""
+Time difference spectra computed directly from the time stamps of
+two detectors. Both time arrays are sorted, so a two pointer sweep
+visits every pair inside the window exactly once, which is O(n + m + pairs)
+and does not need any event building. These spectra are what is
+needed to pick build windows and to time align channels.
+"""
+
+import numpy as np
+import numba as nb
+import polars as pl
+from numpy.typing import NDArray
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
+from .detectors import Detector, tick_times, tick_window
+from .run_handling import Run
+from . import config
+
+
+@nb.njit
+def time_difference_kernel(
+    t_a: NDArray[Any], t_b: NDArray[Any], low: float, high: float, bins: int
+) -> NDArray[np.int64]:
+    """Histogram every t_b - t_a that falls in [low, high).
+
+    :param t_a: sorted time stamps of the first detector
+    :param t_b: sorted time stamps of the second detector
+    :param low: lower edge of the window
+    :param high: upper edge of the window
+    :param bins: number of bins
+    :returns: counts
+    """
+    counts = np.zeros(bins, dtype=np.int64)
+    scale = bins / (high - low)
+    start = 0
+    len_b = len(t_b)
+    for i in range(len(t_a)):
+        a = t_a[i]
+        # t_a is sorted, so hits in b before this window
+        # are before every later window as well
+        while start < len_b and t_b[start] - a < low:
+            start += 1
+        for j in range(start, len_b):
+            dt = t_b[j] - a
+            if dt >= high:
+                break
+            k = int((dt - low) * scale)
+            if k < bins:
+                counts[k] += 1
+    return counts
+
+
+def _times(det: Union[Detector, pl.Series, NDArray[Any]], col=None):
+    if isinstance(det, Detector):
+        times = det[det._time_col_cond(col)].to_numpy()
+    elif isinstance(det, pl.Series):
+        times = det.to_numpy()
+    else:
+        times = np.asarray(det)
+    return tick_times(times)
+
+
+def _common_times(det1, det2, col):
+    t_a = _times(det1, col)
+    t_b = _times(det2, col)
+    if t_a.dtype != t_b.dtype:
+        # integer ticks stay integers, the differences are exact
+        common = (
+            np.int64
+            if np.issubdtype(t_a.dtype, np.integer)
+            and np.issubdtype(t_b.dtype, np.integer)
+            else np.float64
+        )
+        t_a = t_a.astype(common)
+        t_b = t_b.astype(common)
+    return t_a, t_b
+
+
+def time_difference_hist(
+    det1: Union[Detector, pl.Series, NDArray[Any]],
+    det2: Union[Detector, pl.Series, NDArray[Any]],
+    low: float,
+    high: float,
+    bins: int,
+    col: Optional[str] = None,
+    centers: bool = True,
+) -> Tuple[NDArray[Any], NDArray[Any]]:
+    """Histogram of det2 time - det1 time for every pair of hits within
+    [low, high). The return values follow Detector.hist.
+
+    :param det1: Detector (or sorted times) used as the start
+    :param det2: Detector (or sorted times) used as the stop
+    :param low: lower edge of the window
+    :param high: upper edge of the window
+    :param bins: number of bins
+    :param col: time column, defaults to each detector's primary time column
+    :param centers: if True return (bin low edges, counts), else (counts, edges)
+    """
+    if high <= low:
+        raise Exception("Invalid window, high limit is less than low limit.")
+    t_a, t_b = _common_times(det1, det2, col)
+    counts = time_difference_kernel(t_a, t_b, low, high, bins)
+    bin_edges = np.linspace(low, high, bins + 1)
+    if centers:
+        return bin_edges[:-1], counts
+    return counts, bin_edges
+
+
+def find_time_offset(
+    det1: Union[Detector, pl.Series, NDArray[Any]],
+    det2: Union[Detector, pl.Series, NDArray[Any]],
+    low: float,
+    high: float,
+    bins: int,
+    col: Optional[str] = None,
+    peak_bins: int = 3,
+) -> float:
+    """Find the offset that should be added to det2's times to
+    line its coincidence peak up with det1. The peak position is
+    the centroid of the bins around the maximum of the time difference
+    spectrum.
+
+    :param peak_bins: number of bins on each side of the maximum used for the centroid
+    :returns: time offset
+    """
+    t_a, t_b = _common_times(det1, det2, col)
+    counts, edges = time_difference_hist(
+        t_a, t_b, low, high, bins, centers=False
+    )
+    if counts.sum() == 0:
+        return np.nan
+    i = int(np.argmax(counts))
+    lo = max(i - peak_bins, 0)
+    hi = min(i + peak_bins + 1, bins)
+    if np.issubdtype(t_a.dtype, np.integer):
+        # integer differences in [a, b) run from ceil(a) to ceil(b) - 1,
+        # the bin midpoint would be half a tick too high
+        whole = np.ceil(edges)
+        mids = 0.5 * (whole[:-1] + whole[1:] - 1)
+    else:
+        mids = 0.5 * (edges[:-1] + edges[1:])
+    peak = np.sum(mids[lo:hi] * counts[lo:hi]) / np.sum(counts[lo:hi])
+    return -peak
+
+
+def align_channels(
+    run: Union[Run, pl.DataFrame],
+    reference: Union[Detector, pl.Series, NDArray[Any]],
+    low: float,
+    high: float,
+    bins: int,
+    keys: Sequence[str] = ("crate", "module", "channel"),
+    col: Optional[str] = None,
+    peak_bins: int = 3,
+) -> pl.DataFrame:
+    """Solve for the time offset of every channel in a run relative to
+    a reference detector. The result can be passed directly to
+    sauce.CalibrationTable.
+
+    :param run: Run or DataFrame holding all channels
+    :param reference: reference detector (or its sorted times)
+    :param keys: columns that identify a channel
+    :param col: time column, defaults to config.default_time_col
+    :returns: DataFrame with the key columns and time_offset
+    """
+    data = run.data if isinstance(run, Run) else run
+    col = col if col else config.default_time_col
+    keys = [k for k in keys if k in data.columns]
+    t_ref = _times(reference, col)
+    rows: Dict[str, list] = {k: [] for k in keys}
+    rows["time_offset"] = []
+    for part in data.select(keys + [col]).partition_by(
+        keys, maintain_order=True
+    ):
+        offset = find_time_offset(
+            t_ref, part[col], low, high, bins, peak_bins=peak_bins
+        )
+        # channels with nothing in the window are left out of the table
+        if np.isnan(offset):
+            continue
+        for k in keys:
+            rows[k].append(part[k][0])
+        rows["time_offset"].append(offset)
+    return pl.DataFrame(rows)
+
+
+@nb.njit
+def coincidence_matrix_kernel(
+    times: NDArray[Any],
+    det_index: NDArray[np.int64],
+    energy: NDArray[np.float64],
+    window: float,
+    n_dets: int,
+    pair_index: NDArray[np.int64],
+    pair_flip: NDArray[np.bool_],
+    n_pairs: int,
+    e_low: float,
+    e_high: float,
+    bins: int,
+):
+    """Count every pair of hits with a time difference <= window.
+
+    :param times: merged, sorted hit times of all detectors
+    :param det_index: detector number of each hit
+    :param energy: energy of each hit
+    :param window: coincidence window
+    :param n_dets: number of detectors
+    :param pair_index: histogram number for each detector pair, -1 for none
+    :param pair_flip: True if the pair histogram has the detectors swapped
+    :returns: (n_dets, n_dets) counts and (n_pairs, bins, bins) energy histograms
+    """
+    matrix = np.zeros((n_dets, n_dets), dtype=np.int64)
+    hists = np.zeros((n_pairs, bins, bins), dtype=np.int64)
+    scale = bins / (e_high - e_low)
+    n = len(times)
+    for a in range(n):
+        t_a = times[a]
+        d_a = det_index[a]
+        for b in range(a + 1, n):
+            if times[b] - t_a > window:
+                break
+            d_b = det_index[b]
+            matrix[d_a, d_b] += 1
+            if d_a != d_b:
+                matrix[d_b, d_a] += 1
+            k = pair_index[d_a, d_b]
+            if k >= 0:
+                if pair_flip[d_a, d_b]:
+                    x = energy[b]
+                    y = energy[a]
+                else:
+                    x = energy[a]
+                    y = energy[b]
+                if e_low <= x < e_high and e_low <= y < e_high:
+                    hists[
+                        k, int((x - e_low) * scale), int((y - e_low) * scale)
+                    ] += 1
+    return matrix, hists
+
+
+def coincidence_matrix(
+    dets: Sequence[Detector],
+    window: float,
+    pairs: Sequence[Tuple[Union[str, int], Union[str, int]]] = (),
+    energy_range: Tuple[float, float] = (0.0, 4096.0),
+    bins: int = 1024,
+) -> Tuple[NDArray[np.int64], Dict[Tuple[str, str], Any]]:
+    """Coincidence counts between every pair of detectors from one
+    sweep over their merged hits. Two hits are coincident if their
+    times differ by at most window. Hits of the same detector are
+    counted on the diagonal.
+
+    Energy-energy histograms are filled in the same sweep for the
+    detector pairs listed in pairs, using each detector's primary
+    energy column.
+
+    :param dets: list of Detectors
+    :param window: coincidence window
+    :param pairs: (x detector, y detector) names or indices to histogram
+    :param energy_range: (low, high) of both energy axes
+    :param bins: bins per energy axis
+    :returns: (N, N) count matrix and a dict (x name, y name) -> (counts, edges)
+    """
+    names = [d.name for d in dets]
+    all_times = [_times(d) for d in dets]
+    times = np.concatenate(all_times)
+    energy = np.concatenate(
+        [d[d.primary_energy_col].to_numpy().astype(np.float64) for d in dets]
+    )
+    det_index = np.concatenate(
+        [np.full(len(t), i, dtype=np.int64) for i, t in enumerate(all_times)]
+    )
+    order = np.argsort(times, kind="stable")
+
+    n = len(dets)
+    pair_index = np.full((n, n), -1, dtype=np.int64)
+    pair_flip = np.zeros((n, n), dtype=np.bool_)
+    pair_names = []
+    for k, (i, j) in enumerate(pairs):
+        i = names.index(i) if isinstance(i, str) else i
+        j = names.index(j) if isinstance(j, str) else j
+        pair_index[i, j] = k
+        pair_index[j, i] = k
+        pair_flip[j, i] = True
+        pair_names.append((names[i], names[j]))
+
+    window = tick_window(times, 0, window)[1]
+    matrix, hists = coincidence_matrix_kernel(
+        times[order],
+        det_index[order],
+        energy[order],
+        window,
+        n,
+        pair_index,
+        pair_flip,
+        len(pair_names),
+        energy_range[0],
+        energy_range[1],
+        bins,
+    )
+    edges = np.linspace(energy_range[0], energy_range[1], bins + 1)
+    return matrix, {p: (hists[k], edges) for k, p in enumerate(pair_names)}
@@ -0,0 +1,92 @@
+import time
+import numpy as np
+import polars as pl
+import pytest
+import sauce
+
+
+def _uncorrelated(seed=0):
+    rng = np.random.default_rng(seed)
+    ref = sauce.Detector("silicon")
+    ref.data = pl.DataFrame(
+        {
+            "evt_ts": np.sort(rng.integers(0, 10**9, 20000)),
+            "adc": rng.integers(0, 4000, 20000),
+        }
+    )
+    other = sauce.Detector("germanium")
+    other.data = pl.DataFrame(
+        {
+            "evt_ts": np.sort(rng.integers(0, 10**9, 1000000)),
+            "adc": rng.integers(0, 4000, 1000000),
+        }
+    )
+    return ref, other
+
+
+@pytest.mark.parametrize(
+    "background", [[(1000, 1200)], [(1000, 3000)], [(1000, 6000)]]
+)
+def test_random_subtraction_nets_zero(background):
+    ref, other = _uncorrelated()
+    eb = sauce.EventBuilder()
+    eb.add_timestamps(ref)
+    eb.create_build_windows(-100, 100, background=background)
+    coin = sauce.Coincident(eb)[ref, other]
+    prompt = (coin["window"] == 0).sum()
+    net = coin["weight"].sum()
+    # purely random hits, the prompt counts are all background
+    assert prompt > 1000
+    assert abs(net) < 4 * np.sqrt(prompt)
+
+
+def test_prompt_rows_unchanged():
+    ref, other = _uncorrelated(1)
+    eb = sauce.EventBuilder()
+    eb.add_timestamps(ref)
+    eb.create_build_windows(-100, 100)
+    plain = sauce.Coincident(eb)[ref, other]
+    eb.create_build_windows(-100, 100, background=[(1000, 3000)])
+    coin = sauce.Coincident(eb)[ref, other]
+    assert plain.data.equals(
+        coin.data.filter(pl.col("window") == 0).drop("window", "weight")
+    )
+
+
+def test_background_needs_reference():
+    ref, other = _uncorrelated(2)
+    eb = sauce.EventBuilder()
+    eb.add_timestamps(ref)
+    eb.create_build_windows(-100, 100, background=[(1000, 1200)])
+    with pytest.raises(Exception):
+        sauce.Coincident(eb)[other]
+    with pytest.raises(Exception):
+        eb.create_build_windows(-100, 100, background=[(1000, 1100)])
+
+
+def _best_time(f, repeat=5):
+    f()  # compile and warm up
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def test_one_pass_cost():
+    ref, other = _uncorrelated(3)
+
+    def one_pass():
+        eb = sauce.EventBuilder()
+        eb.add_timestamps(ref)
+        eb.create_build_windows(-10, 40, background=[(200, 1200)])
+        return sauce.Coincident(eb)[ref, other]
+
+    def two_passes():
+        prompt = sauce.make_coincidence(ref, -10, 40)[ref, other]
+        randoms = sauce.make_coincidence(ref, 200, 1200)[ref, other]
+        return prompt, randoms
+
+    # 19 background slices, still no slower than building twice
+    assert _best_time(one_pass) < 1.25 * _best_time(two_passes)
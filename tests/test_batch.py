@@ -0,0 +1,20 @@
+import numpy as np
+import polars as pl
+import sauce
+from sauce.batch import merge_results
+
+
+def _run_det(n, livetime):
+    det = sauce.Detector("si")
+    det.data = pl.DataFrame({"adc": np.arange(n), "evt_ts": np.arange(n)})
+    det.livetime = livetime
+    return det
+
+
+def test_merged_livetime_covers_every_run():
+    merged = merge_results(
+        [{"si": _run_det(90, 0.9)}, {"si": _run_det(50, 0.5)}]
+    )["si"]
+    # 140 hits kept out of 100 + 100 offered
+    assert len(merged) == 140
+    assert np.isclose(merged.livetime, 0.7)
@@ -0,0 +1,22 @@
+import polars as pl
+import pytest
+import sauce
+
+
+@pytest.mark.parametrize("dtype", [pl.UInt64, pl.Int64, pl.UInt32])
+def test_time_offsets_on_integer_ticks(dtype):
+    table = sauce.CalibrationTable(
+        pl.DataFrame({"channel": [0, 1], "time_offset": [-3.4, 2.6]}),
+        keys=["channel"],
+    )
+    data = pl.DataFrame(
+        {
+            "channel": [0, 1],
+            "adc": [1, 2],
+            "evt_ts": pl.Series([100, 200]).cast(dtype),
+        }
+    )
+    shifted = table.apply(data)["evt_ts"]
+    # offsets are rounded to whole ticks and keep the column type
+    assert shifted.dtype == dtype
+    assert shifted.to_list() == [97, 203]
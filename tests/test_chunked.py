@@ -0,0 +1,29 @@
+import polars as pl
+import pytest
+import sauce
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 4])
+def test_tied_times_at_chunk_boundary(tmp_path, chunk_size):
+    # the mcp hit at 100 is tied with the si hit that closes the first
+    # chunk of two rows, and belongs to the si window at 90
+    run = tmp_path / "run.parquet"
+    pl.DataFrame(
+        {
+            "channel": [0, 0, 1, 1],
+            "adc": [10, 20, 30, 40],
+            "evt_ts": [90, 100, 100, 200],
+        }
+    ).write_parquet(run)
+    si = sauce.Detector("si").find_hits(str(run), channel=0)
+    mcp = sauce.Detector("mcp").find_hits(str(run), channel=1)
+    expected = sauce.make_coincidence(si, -10, 10)[si, mcp]
+    assert len(expected) == 1
+
+    cc = sauce.ChunkedCoincident(
+        str(run), -10, 10, reference="si", chunk_size=chunk_size
+    )
+    cc.add_detector("si", channel=0)
+    cc.add_detector("mcp", channel=1)
+    coin = cc.build(str(tmp_path / "si_mcp"), "si", "mcp").collect()
+    assert coin.select(expected.data.columns).equals(expected.data)
@@ -0,0 +1,23 @@
+import polars as pl
+import sauce
+from sauce.summary import cached_summary
+
+
+def test_empty_run_summary_round_trip(tmp_path):
+    run = str(tmp_path / "empty.parquet")
+    pl.DataFrame(
+        {
+            "crate": pl.Series([], dtype=pl.Int64),
+            "module": pl.Series([], dtype=pl.Int64),
+            "channel": pl.Series([], dtype=pl.Int64),
+            "adc": pl.Series([], dtype=pl.Int64),
+            "evt_ts": pl.Series([], dtype=pl.Int64),
+        }
+    ).write_parquet(run)
+    summary = sauce.summarize_run(run, rate_bins=20)
+    # the sidecar is reused instead of scanning the run again
+    cached = cached_summary(run)
+    assert cached is not None
+    assert cached.rate.shape == summary.rate.shape == (0, 20)
+    assert cached.counts(module=0, channel=5) == 0
+    assert sauce.select_runs([run], module=0, channel=5) == []
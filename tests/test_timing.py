@@ -0,0 +1,10 @@
+import numpy as np
+from sauce.timing import find_time_offset
+
+
+def test_integer_offsets_are_not_biased():
+    times = np.arange(0, 10**6, 1000)
+    # the reference channel against itself needs no shift
+    assert find_time_offset(times, times, -50, 50, 100) == 0.0
+    assert find_time_offset(times, times + 7, -50, 50, 100) == -7.0
+    assert find_time_offset(times, times - 12, -50, 50, 100) == 12.0